@@ -11,13 +11,67 @@ Histograms of patient age, patient weight, and slice thickness are
 then created from the csv file. Finally, unique study descriptions are
 counted and displayed in a simple table format.
 
+Run without arguments to be prompted for the paths and shown the
+histograms. Given directories, it runs unattended: each directory is a
+cohort whose histograms, study summary and pipeline_stats.json (stage
+timings, throughput, slowest files and parse errors) are written to disk.
+
+Usage: python imaging_data_EDA.py [DIR ...] [--out-dir eda_output] [--rows parquet] [--per series]
 """
 
 
 import os
+import json
+import time
+import heapq
+import argparse
+import itertools
+import contextlib
+import collections
+import numpy
 import pandas
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from pydicom import dcmread
+from pydicom.filereader import read_partial
+from pydicom.tag import Tag
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError: # Parquet and Feather output are optional
+    pyarrow = None
+
+# DICOM header tags read by patient_info
+HEADER_TAGS = ['PatientID', 'PatientAge', 'PatientWeight', 'ManufacturerModelName',
+               'SliceThickness', 'StudyDescription', 'StudyInstanceUID', 'SeriesInstanceUID']
+
+# Tags kept by header-only reads (SpecificCharacterSet is needed to decode text)
+# and the last of them; elements are stored in tag order, so reading stops there
+HEADER_TAG_NUMBERS = [Tag('SpecificCharacterSet')] + [Tag(keyword) for keyword in HEADER_TAGS]
+LAST_HEADER_TAG = max(HEADER_TAG_NUMBERS)
+
+# Columns of the rows created by patient_info
+ROW_COLUMNS = ['PatientID', 'PatientAge', 'PatientWeight', 'MRI_Model', 'SliceThickness', 'StudyDescription',
+               'StudyInstanceUID', 'SeriesInstanceUID']
+
+# DICOM DS columns, held as float32
+NUMERIC_COLUMNS = ['PatientWeight', 'SliceThickness']
+
+# Columns held as text
+TEXT_COLUMNS = ['PatientID', 'MRI_Model', 'StudyDescription', 'StudyInstanceUID', 'SeriesInstanceUID']
+
+# UID column identifying each level rows can be reduced to by unique_rows
+UID_COLUMNS = {'series': 'SeriesInstanceUID', 'study': 'StudyInstanceUID'}
+
+# A DICOM file has this magic after a 128-byte preamble
+DICOM_MAGIC = b'DICM'
+DICOM_MAGIC_OFFSET = 128
+
+# Years per unit of a DICOM AS (age string) value
+AGE_UNITS = {'D': 1 / 365.25, 'W': 7 / 365.25, 'M': 1 / 12, 'Y': 1.0}
 
 def getPath():
     """Obtains correct file path from user.
@@ -34,27 +88,103 @@ def getPath():
             return dir_path
             isValid == True
 
+def is_dicom(file_path):
+    """Checks for the 'DICM' magic that follows the 128-byte preamble of a
+    DICOM file, reading only the first 132 bytes.
+
+    :param file_path: path of the file
+    :return: True if the file starts like a DICOM file
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            header = file.read(DICOM_MAGIC_OFFSET + len(DICOM_MAGIC))
+    except OSError:
+        return False
+    return header[DICOM_MAGIC_OFFSET:] == DICOM_MAGIC
+
+def scan_dir(dir_path, suffixes, check_magic):
+    """Lists one directory with os.scandir.
+
+    :param dir_path: directory to list
+    :param suffixes: file suffixes to accept (lowercase), or None for every file
+    :param check_magic: also accept files with no suffix, and only accept files that pass is_dicom
+    :return: (paths of matching files, paths of subdirectories)
+    """
+    files = []
+    dirs = []
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.is_file():
+                    suffix = os.path.splitext(entry.name)[1].lower()
+                    if suffixes is None or suffix in suffixes or (check_magic and suffix == ''):
+                        if not check_magic or is_dicom(entry.path):
+                            files.append(entry.path)
+    except OSError: # unreadable or vanished directory, skipped like os.walk does
+        pass
+    return files, dirs
+
+def iter_files(dir_path, suffixes=('.dcm',), check_magic=False, workers=1):
+    """Yields the paths of DICOM files in the file path as the walk finds
+    them, so reading can start before the walk is done. Suffixes are matched
+    case-insensitively. With check_magic, files without a suffix (common in
+    PACS exports) are considered too, and a file is only yielded if it has the
+    DICM magic, which costs a 132-byte read per candidate file.
+
+    :param dir_path
+    :param suffixes: file suffixes to accept, or None for every file
+    :param check_magic: detect DICOM files by their preamble magic
+    :param workers: number of threads listing subdirectories concurrently; with
+        more than one, paths come in the order directories finish listing
+    :return: generator of file paths
+    """
+    if suffixes is not None:
+        suffixes = {suffix.lower() for suffix in suffixes}
+    if workers == 1:
+        stack = [dir_path]
+        while stack:
+            files, dirs = scan_dir(stack.pop(), suffixes, check_magic)
+            yield from files
+            stack.extend(reversed(dirs)) # visit subdirectories in listing order
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(scan_dir, dir_path, suffixes, check_magic)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                yield from files
+                pending.update(executor.submit(scan_dir, sub_dir, suffixes, check_magic) for sub_dir in dirs)
+
 def lst_files(dir_path):
     """Generates list of file names ending with '.dcm' in the file path.
 
     :param dir_path
     :return: dcm_files
     """
-    dcm_files = []
-    for root, dirs, files in os.walk(dir_path):
-        for names in files:
-            if names.endswith(".dcm"):
-                dcm_files.append(os.path.join(root, names))
-    return dcm_files
+    return list(iter_files(dir_path))
 
-def read_file(data_path):
-    """ Reads DICOM files.
+def past_header(tag, VR, length):
+    """stop_when callback for read_partial: True once the tags after HEADER_TAGS are reached."""
+    return tag > LAST_HEADER_TAG
 
-    :param data_path: the path to the DICOM file
+def read_file(data_path, header_only=True):
+    """ Reads DICOM files. By default only the tags in HEADER_TAGS are kept and
+    reading stops after the last of them (SeriesInstanceUID), so the rest of
+    the header and the pixel data are never parsed or loaded.
+
+    :param data_path: the path to the DICOM file (or an open binary file)
+    :param header_only: set to False to read the whole dataset, including pixel data
     :return: ds = DICOM stucture
     """
-    ds = dcmread(data_path)
-    return ds
+    if not header_only:
+        return dcmread(data_path)
+    if isinstance(data_path, (str, bytes, os.PathLike)):
+        with open(data_path, 'rb') as file:
+            return read_partial(file, stop_when=past_header, specific_tags=HEADER_TAG_NUMBERS)
+    return read_partial(data_path, stop_when=past_header, specific_tags=HEADER_TAG_NUMBERS)
 
 def create_ds_list(dcm_files):
     """Reads list of dcm files and returns list of DICOM structures.
@@ -71,39 +201,436 @@ def create_ds_list(dcm_files):
 def patient_info(ds_list):
     """Creates a dictionary for each patient with the following keys:
     'PatientAge', 'PatientWeight', 'MRI_Model', 'SliceThickness', 'StudyDescription'.
-    Corresponding values are obtained from the DICOM data in ds_list.
+    Corresponding values are obtained from the DICOM data in ds_list, with
+    None for a tag the file does not have.
 
     :param ds_list = list of DICOM structure data
     :return: patient_data_list
     """
     patient_data_list = []
     for ds in ds_list:
-        info = {"PatientID": ds.PatientID,
-                        "PatientAge": ds.PatientAge,
-                        "PatientWeight": ds.PatientWeight,
-                        "MRI_Model": ds.ManufacturerModelName,
-                        "SliceThickness": ds.SliceThickness,
-                        "StudyDescription": ds.StudyDescription}
+        info = {"PatientID": ds.get("PatientID"),
+                        "PatientAge": ds.get("PatientAge"),
+                        "PatientWeight": ds.get("PatientWeight"),
+                        "MRI_Model": ds.get("ManufacturerModelName"),
+                        "SliceThickness": ds.get("SliceThickness"),
+                        "StudyDescription": ds.get("StudyDescription"),
+                        "StudyInstanceUID": ds.get("StudyInstanceUID"),
+                        "SeriesInstanceUID": ds.get("SeriesInstanceUID")}
         patient_data_list.append(info)
     return patient_data_list
 
+def file_info(data_path):
+    """Reads one DICOM file and returns its patient information.
+
+    :param data_path: the path to the DICOM file
+    :return: dictionary with the same keys as patient_info
+    """
+    return patient_info([read_file(data_path)])[0]
+
+def chunk_info(data_paths):
+    """Reads a chunk of DICOM files in one worker call.
+
+    :param data_paths: list of paths to DICOM files
+    :return: list of dictionaries, one per file
+    """
+    return [file_info(data_path) for data_path in data_paths]
+
+def timed_file_info(data_path):
+    """Reads one DICOM file like file_info, timing the read and the extraction
+    and returning unreadable files as errors instead of raising.
+
+    :param data_path: the path to the DICOM file
+    :return: (data_path, row or None, size in bytes, parse seconds, extract seconds,
+        name of the error or None)
+    """
+    start = time.perf_counter()
+    try:
+        size = os.path.getsize(data_path)
+        ds = read_file(data_path)
+    except Exception as e: # counted by PipelineStats, the run goes on
+        return data_path, None, 0, time.perf_counter() - start, 0.0, type(e).__name__
+    parsed = time.perf_counter()
+    row = patient_info([ds])[0]
+    return data_path, row, size, parsed - start, time.perf_counter() - parsed, None
+
+def timed_chunk_info(data_paths):
+    """Reads a chunk of DICOM files in one worker call with timed_file_info.
+
+    :param data_paths: list of paths to DICOM files
+    :return: list of timed_file_info results, one per file
+    """
+    return [timed_file_info(data_path) for data_path in data_paths]
+
+def map_chunks(chunk_fn, dcm_files, workers=None, chunksize=16, use_threads=False):
+    """Applies chunk_fn to chunks of dcm_files across a pool of workers and
+    yields the results for each file in the order of dcm_files. Only a couple
+    of chunks per worker are in flight at once, so dcm_files can be a
+    generator over an archive of any size.
+
+    :param chunk_fn: function taking a list of paths and returning a list with a result per path
+    :param dcm_files: iterable of DICOM file paths
+    :param workers: number of worker processes (or threads), default is the number of CPUs
+    :param chunksize: number of files sent to a worker at a time
+    :param use_threads: use a thread pool instead of processes, for storage where I/O latency dominates
+    :return: generator of results
+    """
+    dcm_files = iter(dcm_files)
+    if workers == 1: # no pool to start
+        for file in dcm_files:
+            yield from chunk_fn([file])
+        return
+    workers = workers or os.cpu_count() or 1
+    pool = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+    with pool(max_workers=workers) as executor:
+        pending = collections.deque()
+        for chunk in iter(lambda: list(itertools.islice(dcm_files, chunksize)), []):
+            pending.append(executor.submit(chunk_fn, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def iter_patient_info(dcm_files, workers=None, chunksize=16, use_threads=False, stats=None):
+    """Yields the patient information of each DICOM file in the order of
+    dcm_files, reading them across a pool of workers (see map_chunks).
+
+    :param dcm_files: iterable of DICOM file paths
+    :param workers: number of worker processes (or threads), default is the number of CPUs
+    :param chunksize: number of files sent to a worker at a time
+    :param use_threads: use a thread pool instead of processes, for storage where I/O latency dominates
+    :param stats: PipelineStats to record each file in; unreadable files are then
+        counted and skipped instead of raising
+    :return: generator of dictionaries with the same keys as patient_info
+    """
+    if stats is None:
+        yield from map_chunks(chunk_info, dcm_files, workers, chunksize, use_threads)
+        return
+    for result in map_chunks(timed_chunk_info, dcm_files, workers, chunksize, use_threads):
+        row = stats.add_file(*result)
+        if row is not None:
+            yield row
+
+def parallel_patient_info(dcm_files, workers=None, chunksize=16, use_threads=False):
+    """Reads DICOM files across a pool of workers. Returns the same rows as
+    patient_info(create_ds_list(dcm_files)), in the same order as dcm_files.
+
+    :param dcm_files: list of DICOM file paths
+    :param workers: number of worker processes (or threads), default is the number of CPUs
+    :param chunksize: number of files sent to a worker at a time
+    :param use_threads: use a thread pool instead of processes, for storage where I/O latency dominates
+    :return: patient_data_list
+    """
+    return list(iter_patient_info(dcm_files, workers, chunksize, use_threads))
+
+# Stages timed by PipelineStats, in pipeline order
+STAGES = ['walk', 'parse', 'extract', 'output']
+
+class PipelineStats:
+    """Timings and throughput of an extraction run, cheap enough to leave on:
+    a few perf_counter calls per file and a bounded heap of the slowest files.
+
+    walk is the time spent listing files (iter_files), parse reading headers
+    (read_file), extract building rows and dataframes (patient_info,
+    create_dataFrame) and output writing files. walk and output are wall time
+    in the calling process. parse and extract are summed over the files, in
+    whichever worker read them, so with several workers they can add up to
+    more than the wall time of the run.
+    """
+    def __init__(self, slowest=10, error_examples=10):
+        self.slowest = slowest
+        self.error_examples = error_examples
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.files = 0
+        self.bytes = 0
+        self.errors = collections.Counter() # error name -> files
+        self.error_paths = []
+        self.slow = [] # min-heap of (seconds, path, bytes) holding the slowest files
+        self.info = {} # extra entries for the report
+        self.start = time.perf_counter()
+        self.end = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Adds the wall time of the with-block to stage `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+    def timed(self, name, iterable):
+        """Passes on the items of iterable, adding the time spent producing them to stage `name`."""
+        iterator = iter(iterable)
+        done = object()
+        while True:
+            start = time.perf_counter()
+            item = next(iterator, done)
+            self.seconds[name] += time.perf_counter() - start
+            if item is done:
+                return
+            yield item
+
+    def add_file(self, path, row, size, parse_seconds, extract_seconds, error):
+        """Records a timed_file_info result.
+
+        :return: the row, or None for an unreadable file
+        """
+        self.seconds['parse'] += parse_seconds
+        self.seconds['extract'] += extract_seconds
+        if error is not None:
+            self.errors[error] += 1
+            if len(self.error_paths) < self.error_examples:
+                self.error_paths.append(path)
+            return None
+        self.files += 1
+        self.bytes += size
+        entry = (parse_seconds + extract_seconds, path, size)
+        if len(self.slow) < self.slowest:
+            heapq.heappush(self.slow, entry)
+        elif entry > self.slow[0]:
+            heapq.heapreplace(self.slow, entry)
+        return row
+
+    def stop(self):
+        """Ends the run's wall clock."""
+        self.end = time.perf_counter()
+
+    def report(self):
+        """Returns the run's statistics as a JSON-serialisable dictionary."""
+        wall = (self.end or time.perf_counter()) - self.start
+        report = {'wall_seconds': round(wall, 6),
+                  'files': self.files,
+                  'bytes': self.bytes,
+                  'files_per_s': round(self.files / wall, 1) if wall else None,
+                  'bytes_per_s': round(self.bytes / wall) if wall else None,
+                  'stages': {name: {'seconds': round(seconds, 6),
+                                    'share_of_wall': round(seconds / wall, 3) if wall else None}
+                             for name, seconds in self.seconds.items()},
+                  'parse_errors': {'count': sum(self.errors.values()), 'by_type': dict(self.errors),
+                                   'examples': self.error_paths},
+                  'slowest_files': [{'path': path, 'seconds': round(seconds, 6), 'bytes': size}
+                                    for seconds, path, size in sorted(self.slow, reverse=True)]}
+        report.update(self.info)
+        return report
+
+    def write(self, path):
+        """Writes the report to path as JSON."""
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+def unique_rows(rows, level='series', counts=None):
+    """Passes on the first row of each series (or study) and drops the rest,
+    so a 300-slice series contributes one row instead of 300. Rows without
+    the UID are all kept.
+
+    :param rows: iterable of dictionaries from patient_info
+    :param level: 'series' to keep one row per SeriesInstanceUID, 'study' per StudyInstanceUID
+    :param counts: optional dictionary filled in with the number of rows seen per UID
+    :return: generator of rows
+    """
+    key = UID_COLUMNS[level]
+    seen = set()
+    for row in rows:
+        uid = row.get(key)
+        if counts is not None and uid is not None:
+            counts[uid] = counts.get(uid, 0) + 1
+        if uid is None or uid not in seen:
+            if uid is not None:
+                seen.add(uid)
+            yield row
+
+def plain_value(value):
+    """Converts a header value from pydicom (DSfloat, IS, PersonName, ...) to a
+    plain Python value that can be stored outside of pydicom.
+
+    :param value: header value or None
+    :return: int, float, str or None
+    """
+    if value is None or type(value) in (int, float, str):
+        return value
+    if isinstance(value, int): # pydicom IS
+        return int(value)
+    if isinstance(value, float): # pydicom DSfloat
+        return float(value)
+    return str(value)
+
+def by_unique(values, convert):
+    """Applies a vectorized conversion to the distinct values of a series only
+    and spreads the results back, since header columns repeat a few values
+    many times. Missing values become NaN.
+
+    :param values: series
+    :param convert: function from a series to a float series of the same length
+    :return: float32 series aligned with values
+    """
+    codes, uniques = pandas.factorize(values.astype(object))
+    converted = numpy.append(convert(pandas.Series(uniques, dtype=object)).to_numpy(dtype='float32'),
+                             numpy.float32('nan')) # code -1 (missing) picks the last slot
+    return pandas.Series(converted[codes], index=values.index)
+
+def age_years(ages):
+    """Converts DICOM AS ages ('045Y', '018M', '003W', '010D') to years.
+    Values without a unit are taken as years; missing or unreadable values become NaN.
+
+    :param ages: series of AS strings (or of numbers, returned as they are)
+    :return: float32 series of ages in years
+    """
+    if pandas.api.types.is_numeric_dtype(ages):
+        return ages.astype('float32')
+
+    def parse(uniques):
+        parts = uniques.astype('string').str.strip().str.upper().str.extract(r'^(\d+)([DWMY]?)$')
+        number = pandas.to_numeric(parts[0].astype(object), errors='coerce')
+        unit = parts[1].astype(object).replace('', 'Y').map(AGE_UNITS)
+        return (number * unit).astype('float64')
+
+    return by_unique(ages, parse)
+
+def normalise(patientDataFrame):
+    """Gives the patient dataframe its column types in a few vectorized passes:
+    PatientAge in years and PatientWeight and SliceThickness (DICOM DS values)
+    as float32, and the text columns as strings. Missing values become NaN.
+
+    :param patientDataFrame: dataframe with the ROW_COLUMNS, as built from patient_info rows or reloaded
+    :return: patientDataFrame with normalised columns
+    """
+    patientDataFrame = patientDataFrame.reindex(columns=ROW_COLUMNS)
+    patientDataFrame['PatientAge'] = age_years(patientDataFrame['PatientAge'])
+    for col in NUMERIC_COLUMNS:
+        if pandas.api.types.is_numeric_dtype(patientDataFrame[col]):
+            patientDataFrame[col] = patientDataFrame[col].astype('float32')
+        else:
+            patientDataFrame[col] = by_unique(patientDataFrame[col],
+                                              lambda uniques: pandas.to_numeric(uniques, errors='coerce').astype('float64'))
+    for col in TEXT_COLUMNS:
+        patientDataFrame[col] = patientDataFrame[col].astype('string')
+    return patientDataFrame
+
 def create_dataFrame(patient_data_list):
-    """Creates dataframe from the patient_data_list.
+    """Creates dataframe from the patient_data_list, with normalised column types.
 
     :param patient_data_list: list of patient data from DICOM headers
     :return: patientDataFrame
     """
-    patientDataFrame = pandas.DataFrame(patient_data_list)
-    return patientDataFrame
+    patientDataFrame = pandas.DataFrame(patient_data_list, columns=ROW_COLUMNS, dtype=object)
+    return normalise(patientDataFrame)
 
-def getSavePath():
+# File extension -> format written by TableSink
+FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+
+class TableSink:
+    """Writes a table batch by batch to a csv file, a Parquet file (.parquet)
+    or a Feather / Arrow IPC file (.feather, .arrow). The columnar formats
+    keep the column types, so reloading them needs no parsing.
+    """
+    def __init__(self, out_path):
+        self.out_path = out_path
+        self.format = FORMATS.get(os.path.splitext(out_path)[1].lower(), 'csv')
+        if self.format != 'csv' and pyarrow is None:
+            raise ImportError("Writing " + self.format + " files requires pyarrow")
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+
+    def write(self, frame):
+        """Appends a dataframe with the ROW_COLUMNS to the file."""
+        if self.format == 'csv':
+            frame.to_csv(self.out_path, mode='a' if self.rows else 'w', header=not self.rows, index=False)
+        else:
+            table = pyarrow.Table.from_pandas(frame, schema=self.schema, preserve_index=False)
+            if self.writer is None:
+                self.schema = table.schema # later batches are cast to the first batch's types
+                if self.format == 'parquet':
+                    self.writer = pyarrow.parquet.ParquetWriter(self.out_path, self.schema)
+                else:
+                    self.writer = pyarrow.ipc.new_file(self.out_path, self.schema)
+            self.writer.write_table(table)
+        self.rows += len(frame)
+
+    def close(self):
+        """Finishes the file; a table with no rows is still written with its header."""
+        if self.rows == 0 and self.writer is None:
+            self.write(create_dataFrame([]))
+        if self.writer is not None:
+            self.writer.close()
+
+def extract_frame(rows, out_path=None, batch_size=10000, stats=None):
+    """Builds the patient dataframe from rows of patient information, batch_size
+    rows at a time, optionally saving each batch to out_path as it is built.
+
+    :param rows: iterable of dictionaries with the keys in ROW_COLUMNS
+    :param out_path: csv, Parquet or Feather file to save the rows to, or None
+    :param batch_size: number of rows converted (and written) at a time
+    :param stats: PipelineStats to add the conversion (extract) and writing (output) times to
+    :return: patientDataFrame
+    """
+    stage = stats.stage if stats is not None else lambda name: contextlib.nullcontext()
+    rows = iter(rows)
+    sink = TableSink(out_path) if out_path else None
+    frames = []
+    try:
+        for batch in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+            with stage('extract'):
+                frames.append(create_dataFrame(batch))
+            if sink is not None:
+                with stage('output'):
+                    sink.write(frames[-1])
+    finally:
+        if sink is not None:
+            with stage('output'):
+                sink.close()
+    if not frames:
+        return create_dataFrame([])
+    with stage('extract'):
+        return pandas.concat(frames, ignore_index=True)
+
+def write_rows(rows, out_path, batch_size=10000):
+    """Writes rows of patient information to a csv, Parquet or Feather file
+    batch_size rows at a time, so only one batch is held in memory however
+    many rows there are.
+
+    :param rows: iterable of dictionaries with the keys in ROW_COLUMNS
+    :param out_path: save path for the csv, Parquet or Feather file
+    :param batch_size: number of rows converted and written at a time
+    :return: number of rows written
+    """
+    rows = iter(rows)
+    sink = TableSink(out_path)
+    try:
+        for batch in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+            sink.write(create_dataFrame(batch))
+    finally:
+        sink.close()
+    return sink.rows
+
+def read_rows(path):
+    """Reads a table written by write_rows or extract_frame.
+
+    :param path: path of a csv, Parquet or Feather file
+    :return: dataframe
+    """
+    fileFormat = FORMATS.get(os.path.splitext(path)[1].lower(), 'csv')
+    if fileFormat == 'parquet':
+        return pandas.read_parquet(path)
+    if fileFormat == 'feather':
+        return pandas.read_feather(path)
+    return normalise(pandas.read_csv(path, dtype={col: 'string' for col in TEXT_COLUMNS}))
+
+def getSavePath(optional=False):
     """Obtains save path for saving a csv file.
 
-    :return: csv_path
+    :param optional: if True, an empty answer means the file is not saved
+    :return: csv_path, or None if optional and left empty
     """
     isValid = False
     while isValid == False:
-        csv_path = input("\nEnter a save path for the csv: ")
+        if optional:
+            csv_path = input("\nEnter a save path for the csv, .parquet or .feather file (leave empty to skip): ")
+            if csv_path == '':
+                return None
+        else:
+            csv_path = input("\nEnter a save path for the csv: ")
         checkCsvPath = input(f"\nIs {csv_path} correct? (Enter 'y' if correct): ")
         if checkCsvPath.lower() == 'y':
             isValid = True
@@ -126,10 +653,7 @@ def createHistAge(df_patients):
     :param df_patients: dataframe list of patients from csv file
     :return: histogram of 'PatientAge'
     """
-    df_patients['PatientAge'] = df_patients['PatientAge'].str.extract('(\d+)',expand=False) # pass regex pattern to extract just numeric part from 'PatientAge'
-    df_patients['PatientAge'] = df_patients['PatientAge'].astype(int) # convert Dtype of 'PatientAge' to integer
-
-    patient_age = df_patients['PatientAge']
+    patient_age = df_patients['PatientAge'].dropna() # ages in years, see normalise
     # label histogram
     plt.xlabel('Age')
     plt.ylabel('Count')
@@ -145,7 +669,7 @@ def createHistSlice(df_patients):
     :param df_patients: dataframe list of patients from csv file
     :return: histogram of 'SliceThickness'
     """
-    sliceThickness = df_patients['SliceThickness']
+    sliceThickness = df_patients['SliceThickness'].dropna()
     # label histogram
     plt.xlabel('Slice Thickness')
     plt.ylabel('Count')
@@ -161,7 +685,7 @@ def createHistWeight(df_patients):
     :param df_patients: dataframe list of patients from csv file
     :return: histogram of patient weight
     """
-    patient_weight = df_patients['PatientWeight']
+    patient_weight = df_patients['PatientWeight'].dropna()
     # label histogram
     plt.xlabel('Weight')
     plt.ylabel('Count')
@@ -183,18 +707,135 @@ def processData(df_patients):
     studySummary = df_patients.groupby('StudyDescription').size().reset_index().rename(columns={0:'PatientID'})
     return studySummary
 
-def main():
-    """Main function of Exploratory Data Analysis on Imaging Data"""
+# Histograms drawn for each cohort: column, x axis label, title, file name stem
+HISTOGRAMS = [('PatientAge', 'Age', 'Number of Patients by Age', 'age'),
+              ('SliceThickness', 'Slice Thickness', 'MRI Image Slice Thickness', 'slice_thickness'),
+              ('PatientWeight', 'Weight', 'Number of Patients by Weight', 'weight')]
+
+def histogram_bins(df_patients, columns, bins='auto'):
+    """Computes the histogram of each numeric column with NumPy, reading the
+    columns out of the dataframe together as one float array.
+
+    :param df_patients: dataframe of patient data
+    :param columns: numeric columns to bin
+    :param bins: bin count or NumPy bin estimator, as for numpy.histogram
+    :return: dictionary of column -> (counts, bin edges); missing values are left out
+    """
+    values = df_patients[columns].to_numpy(dtype='float64', na_value=numpy.nan)
+    hists = {}
+    for i, col in enumerate(columns):
+        column = values[:, i]
+        column = column[numpy.isfinite(column)]
+        hists[col] = numpy.histogram(column, bins=bins if len(column) else 1)
+    return hists
+
+def render_histograms(df_patients, out_dir, fig_format='png', bins='auto'):
+    """Writes the HISTOGRAMS of df_patients to out_dir without a display.
+    Figures are drawn with the Agg canvas directly, outside pyplot's global
+    state, from bins computed by histogram_bins.
+
+    :param df_patients: dataframe of patient data
+    :param out_dir: directory the figures are saved to, created if missing
+    :param fig_format: image format, e.g. 'png', 'svg' or 'pdf'
+    :param bins: bin count or NumPy bin estimator
+    :return: list of paths of the saved figures
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    hists = histogram_bins(df_patients, [col for col, _, _, _ in HISTOGRAMS], bins)
+    paths = []
+    for col, xlabel, title, stem in HISTOGRAMS:
+        counts, edges = hists[col]
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel('Count')
+        ax.set_title(title)
+        ax.grid()
+        ax.stairs(counts, edges, fill=True)
+        path = os.path.join(out_dir, stem + '.' + fig_format)
+        fig.savefig(path)
+        paths.append(path)
+    return paths
+
+def analyse_dir(dir_path, out_dir, rows_format=None, fig_format='png', per='file', workers=None,
+                check_magic=False, cache_path=None, stats=None):
+    """Runs the whole analysis of one directory unattended: extracts the rows,
+    writes the histograms and the study summary to out_dir and, if asked,
+    the rows themselves.
+
+    :param dir_path: directory of DICOM files
+    :param out_dir: directory for this directory's outputs, created if missing
+    :param rows_format: 'csv', 'parquet' or 'feather' to save the rows as rows.<format>, or None
+    :param fig_format: image format of the histograms
+    :param per: 'file' for a row per file, 'series' or 'study' for one row per series or study
+    :param workers: number of parser processes, see iter_patient_info
+    :param check_magic: detect DICOM files by their preamble magic, see iter_files
+    :param cache_path: ManifestCache database to scan through, or None to parse every file
+    :param stats: PipelineStats to record the run in; its report is written to
+        out_dir/pipeline_stats.json and unreadable files are skipped
+    :return: (df_patients, studySummary)
+    """
+    stage = stats.stage if stats is not None else lambda name: contextlib.nullcontext()
+    os.makedirs(out_dir, exist_ok=True)
+    rows_path = os.path.join(out_dir, 'rows.' + rows_format) if rows_format else None
+    if cache_path:
+        from imaging_manifest import ManifestCache, scan # imaging_manifest imports this module
+        cache = ManifestCache(cache_path)
+        try:
+            counts = scan(dir_path, cache, workers, stats=stats, check_magic=check_magic)
+            rows = cache.rows(dir_path) # streamed from the cache, so it stays open until the frame is built
+            if stats is not None:
+                rows = stats.timed('extract', rows)
+            if per != 'file':
+                rows = unique_rows(rows, per)
+            df_patients = extract_frame(rows, rows_path, stats=stats)
+        finally:
+            cache.close()
+        if stats is not None:
+            stats.info['manifest'] = counts
+    else:
+        dcm_files = iter_files(dir_path, check_magic=check_magic)
+        if stats is not None:
+            dcm_files = stats.timed('walk', dcm_files)
+        rows = iter_patient_info(dcm_files, workers, stats=stats)
+        if per != 'file':
+            rows = unique_rows(rows, per)
+        df_patients = extract_frame(rows, rows_path, stats=stats)
+    studySummary = processData(df_patients)
+    with stage('output'):
+        render_histograms(df_patients, out_dir, fig_format)
+        save_csv(studySummary, os.path.join(out_dir, 'study_summary.csv'))
+    if stats is not None:
+        stats.stop()
+        stats.info['rows'] = len(df_patients)
+        stats.write(os.path.join(out_dir, 'pipeline_stats.json'))
+    return df_patients, studySummary
+
+def cohort_names(dir_paths):
+    """Names each directory by its base name, numbering repeated names.
+
+    :param dir_paths: list of directories
+    :return: list of names, one per directory
+    """
+    names = []
+    for dir_path in dir_paths:
+        name = os.path.basename(os.path.normpath(os.path.abspath(dir_path))) or 'root'
+        candidate, n = name, 2
+        while candidate in names:
+            candidate, n = name + '_' + str(n), n + 1
+        names.append(candidate)
+    return names
+
+def interactive():
+    """Prompts for the directory and save paths and shows the histograms on screen."""
 
     # Create Info Sheet
     dir_path = getPath() # get directory path
-    dcm_files = lst_files(dir_path) # get list of dcm file paths
-    ds_list = create_ds_list(dcm_files) # get list of DICOM structure for each file
-    patient_data_list = patient_info(ds_list) # for each patient create a dictionary from the DICOM structure
-    patientDataFrame = create_dataFrame(patient_data_list) # create dataframe for each patient in patient_data_list
-    csv_path = getSavePath() # get csv path save location from user
-    save_csv(patientDataFrame,csv_path) # save dataframe to csv
-    df_patients = pandas.read_csv(csv_path) # read in dataset from csv file
+    save_path = getSavePath(optional=True) # get csv, .parquet or .feather save location from user, if any
+    dcm_files = iter_files(dir_path) # walk the directory lazily
+    patient_rows = iter_patient_info(dcm_files) # read the files in parallel and create a dictionary for each patient
+    df_patients = extract_frame(patient_rows,save_path) # build the dataframe, saving each batch as it is built
 
     # create histograms
     createHistAge(df_patients) # create histogram of patient age
@@ -208,4 +849,40 @@ def main():
     summary_csv_path = getSavePath()
     save_csv(studySummary,summary_csv_path)
 
-main()
+def main(argv=None):
+    """Main function of Exploratory Data Analysis on Imaging Data"""
+    parser = argparse.ArgumentParser(description='Exploratory Data Analysis on Imaging Data')
+    parser.add_argument('dirs', nargs='*', metavar='DIR',
+                        help='directories of DICOM files, one cohort each (prompted for if omitted)')
+    parser.add_argument('--out-dir', default='eda_output',
+                        help='outputs of each cohort go to OUT_DIR/<cohort name>')
+    parser.add_argument('--rows', choices=['csv', 'parquet', 'feather'],
+                        help='also save the extracted rows in this format')
+    parser.add_argument('--fig-format', default='png', help='image format of the histograms')
+    parser.add_argument('--per', choices=['file', 'series', 'study'], default='file',
+                        help='one row per file (default), series or study')
+    parser.add_argument('--workers', type=int, help='parser processes (default: number of CPUs)')
+    parser.add_argument('--check-magic', action='store_true',
+                        help='detect DICOM files by their preamble, including files without a suffix')
+    parser.add_argument('--cache', metavar='SQLITE', help='re-parse only files changed since the last run')
+    parser.add_argument('--slowest', type=int, default=10, help='slowest files listed in pipeline_stats.json')
+    args = parser.parse_args(argv)
+
+    if not args.dirs:
+        interactive()
+        return
+    for dir_path, name in zip(args.dirs, cohort_names(args.dirs)):
+        out_dir = os.path.join(args.out_dir, name)
+        stats = PipelineStats(args.slowest)
+        df_patients, studySummary = analyse_dir(dir_path, out_dir, args.rows, args.fig_format, args.per,
+                                                args.workers, args.check_magic, args.cache, stats)
+        report = stats.report()
+        print(name + ': ' + str(len(df_patients)) + ' rows, ' + str(len(studySummary))
+              + ' study descriptions, written to ' + out_dir)
+        print('  %d files, %.1f files/s, %.1f MB/s, %d parse errors; %s' % (
+            report['files'], report['files_per_s'] or 0, (report['bytes_per_s'] or 0) / 2**20,
+            report['parse_errors']['count'],
+            ', '.join('%s %.2fs' % (stage, seconds) for stage, seconds in stats.seconds.items())))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Synthetic DICOM archives for imaging_data_EDA
+
+Writes MR images with the header fields imaging_data_EDA reads, laid out
+like a PACS export: one folder per patient holding one study of two
+10-slice series. Each file carries an 8 KB private vendor block so header
+parsing costs about what it does on scanner output. A number of unreadable
+files can be mixed in to exercise the parse-error accounting.
+
+Usage: python imaging_fixtures.py OUT_DIR [--files 500] [--size 256] [--corrupt 0] [--seed N]
+"""
+
+import os
+import random
+import argparse
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+
+def write_dicom(path, patientID, rows=256, columns=256, studyUID=None, seriesUID=None):
+    """Writes a small MR image with the header fields imaging_data_EDA reads,
+    followed by the kind of private header block scanners add.
+
+    :param path: file to write
+    :param patientID: value for PatientID
+    :param rows: image height
+    :param columns: image width
+    :param studyUID: StudyInstanceUID, a new one if None
+    :param seriesUID: SeriesInstanceUID, a new one if None
+    :return: None
+    """
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = MRImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.PatientID = patientID
+    ds.PatientAge = str(random.randint(18, 90)).zfill(3) + 'Y'
+    ds.PatientWeight = str(random.randint(45, 120))
+    ds.ManufacturerModelName = random.choice(['Skyra', 'Prisma', 'Signa HDxt', 'Achieva'])
+    ds.SliceThickness = random.choice(['1.0', '3.0', '5.0'])
+    ds.StudyDescription = random.choice(['BRAIN', 'KNEE', 'SPINE', 'BREAST'])
+    ds.Modality = 'MR'
+    ds.StudyInstanceUID = studyUID or generate_uid()
+    ds.SeriesInstanceUID = seriesUID or generate_uid()
+    ds.ImagePositionPatient = [0.0, 0.0, float(random.randint(0, 200))]
+    ds.ImageOrientationPatient = [1.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+    ds.add_new(0x00290010, 'LO', 'SIEMENS CSA HEADER')
+    ds.add_new(0x00291010, 'OB', os.urandom(8192)) # vendor header, as large as a CSA block
+    ds.Rows = rows
+    ds.Columns = columns
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated = 16
+    ds.BitsStored = 12
+    ds.HighBit = 11
+    ds.PixelRepresentation = 0
+    ds.PixelData = np.random.randint(0, 4096, (rows, columns), dtype=np.uint16).tobytes()
+    ds.save_as(path, enforce_file_format=True)
+
+def write_corrupt(path, size=4096):
+    """Writes a file with a .dcm name but no DICOM preamble, which read_file rejects.
+
+    :param path: file to write
+    :param size: number of random bytes
+    :return: None
+    """
+    with open(path, 'wb') as file:
+        file.write(os.urandom(size))
+
+def make_archive(dirPath, files, size=256, corrupt=0):
+    """Writes `files` synthetic size x size DICOM images under dirPath: one
+    folder per patient holding one study of two 10-slice series.
+
+    :param dirPath: directory to write to, created if missing
+    :param files: number of DICOM files
+    :param size: image width and height
+    :param corrupt: number of unreadable files added, spread across the patient folders
+    :return: None
+    """
+    uids = {}
+    for i in range(files):
+        patient = i // 20
+        folder = os.path.join(dirPath, 'patient' + str(patient).zfill(5))
+        os.makedirs(folder, exist_ok=True)
+        studyUID = uids.setdefault(('study', patient), generate_uid())
+        seriesUID = uids.setdefault(('series', i // 10), generate_uid())
+        write_dicom(os.path.join(folder, str(i).zfill(6) + '.dcm'), 'PAT' + str(patient).zfill(5), size, size,
+                    studyUID, seriesUID)
+    patients = max(1, (files + 19) // 20)
+    for i in range(corrupt):
+        folder = os.path.join(dirPath, 'patient' + str(i % patients).zfill(5))
+        os.makedirs(folder, exist_ok=True)
+        write_corrupt(os.path.join(folder, 'corrupt' + str(i).zfill(6) + '.dcm'))
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic DICOM archive')
+    parser.add_argument('out_dir', help='directory to write the archive to')
+    parser.add_argument('--files', type=int, default=500, help='number of DICOM files')
+    parser.add_argument('--size', type=int, default=256, help='image width and height')
+    parser.add_argument('--corrupt', type=int, default=0, help='number of unreadable .dcm files to add')
+    parser.add_argument('--seed', type=int, help='seed for the header values and pixel data')
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+    make_archive(args.out_dir, args.files, args.size, args.corrupt)
+    print(str(args.files) + ' DICOM files and ' + str(args.corrupt) + ' corrupt files written to ' + args.out_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Incremental DICOM inventory for imaging_data_EDA
+
+Keeps the header fields extracted from every DICOM file in an SQLite
+manifest, keyed by path and stored with the file's size and modification
+time. A re-scan only parses files that are new or whose size or mtime has
+changed, and evicts files that have been deleted, so re-scanning an
+unchanged archive costs one directory walk and one manifest read.
+
+Usage: python imaging_manifest.py DIR [--cache manifest.sqlite] [--out rows.csv] [--workers N] [--check-magic]
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+import itertools
+import collections
+from imaging_data_EDA import (ROW_COLUMNS, iter_files, iter_patient_info, map_chunks, timed_chunk_info, plain_value,
+                              write_rows)
+
+# Columns of the manifest table ahead of the ROW_COLUMNS
+KEY_COLUMNS = ['path', 'size', 'mtime_ns']
+
+
+class ManifestCache:
+    """SQLite table of extracted header rows keyed by absolute file path."""
+
+    def __init__(self, cache_path):
+        self.conn = sqlite3.connect(cache_path, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        existing = [row[1] for row in self.conn.execute('PRAGMA table_info(files)')]
+        if existing and existing != KEY_COLUMNS + ROW_COLUMNS: # extracted columns changed, parse everything again
+            self.conn.execute('DROP TABLE files')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                          'mtime_ns INTEGER NOT NULL, '
+                          + ', '.join('"' + col + '"' for col in ROW_COLUMNS) + ')')
+
+    def entries(self, root):
+        """Returns {path: (size, mtime_ns)} for the cached files under root."""
+        low, high = path_range(root)
+        return {path: (size, mtime_ns) for path, size, mtime_ns in self.conn.execute(
+            'SELECT path, size, mtime_ns FROM files WHERE path >= ? AND path < ?', (low, high))}
+
+    def update(self, entries):
+        """Inserts or replaces (path, size, mtime_ns, row) entries in one transaction."""
+        placeholders = ', '.join('?' * (len(KEY_COLUMNS) + len(ROW_COLUMNS)))
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany('INSERT OR REPLACE INTO files VALUES (' + placeholders + ')',
+                                  [(path, size, mtime_ns) + tuple(plain_value(row.get(col)) for col in ROW_COLUMNS)
+                                   for path, size, mtime_ns, row in entries])
+
+    def evict(self, paths):
+        """Deletes the given paths from the manifest."""
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in paths))
+
+    def rows(self, root):
+        """Yields the cached rows for the files under root, ordered by path."""
+        low, high = path_range(root)
+        cursor = self.conn.execute('SELECT ' + ', '.join('"' + col + '"' for col in ROW_COLUMNS)
+                                   + ' FROM files WHERE path >= ? AND path < ? ORDER BY path', (low, high))
+        for values in cursor:
+            yield dict(zip(ROW_COLUMNS, values))
+
+    def close(self):
+        self.conn.close()
+
+def path_range(root):
+    """Bounds of the paths under root, for an index range scan on the path key.
+
+    :param root: directory
+    :return: (low, high) with low <= path < high for every path under root
+    """
+    prefix = os.path.join(os.path.abspath(root), '')
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def scan(dir_path, cache, workers=None, chunksize=16, use_threads=False, batch_size=1000, stats=None,
+         check_magic=False):
+    """Brings the manifest up to date with the DICOM files under dir_path.
+    Files whose size and mtime match the manifest are not opened.
+
+    :param dir_path: directory to scan
+    :param cache: ManifestCache
+    :param workers: number of worker processes for parsing, see iter_patient_info
+    :param chunksize: number of files sent to a worker at a time
+    :param use_threads: parse with threads instead of processes
+    :param batch_size: number of parsed files written to the manifest per transaction
+    :param stats: PipelineStats to record the parsed files in; unreadable files are
+        then counted and left out of the manifest instead of raising
+    :param check_magic: detect DICOM files by their preamble magic, including files without a suffix, see iter_files
+    :return: dictionary of counts: new, changed, unchanged, evicted
+    """
+    root = os.path.abspath(dir_path)
+    known = cache.entries(root) # whatever is left at the end has been deleted
+    counts = {'new': 0, 'changed': 0, 'unchanged': 0, 'evicted': 0}
+    pending = collections.deque() # (path, size, mtime_ns) of files handed to the parser, in order
+
+    def stale_files():
+        for path in iter_files(root, check_magic=check_magic):
+            stat = os.stat(path)
+            key = (stat.st_size, stat.st_mtime_ns)
+            cached = known.pop(path, None)
+            if cached == key:
+                counts['unchanged'] += 1
+                continue
+            counts['new' if cached is None else 'changed'] += 1
+            pending.append((path,) + key)
+            yield path
+
+    if stats is None:
+        rows = iter_patient_info(stale_files(), workers, chunksize, use_threads)
+        for batch in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+            cache.update([pending.popleft() + (row,) for row in batch])
+    else:
+        results = map_chunks(timed_chunk_info, stats.timed('walk', stale_files()), workers, chunksize, use_threads)
+        for batch in iter(lambda: list(itertools.islice(results, batch_size)), []):
+            entries = [(pending.popleft(), stats.add_file(*result)) for result in batch]
+            with stats.stage('output'):
+                cache.update([key + (row,) for key, row in entries if row is not None])
+    cache.evict(known)
+    counts['evicted'] = len(known)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description='Incrementally scan a DICOM archive into a manifest')
+    parser.add_argument('dir', help='directory of DICOM files')
+    parser.add_argument('--cache', default='dicom_manifest.sqlite', help='manifest database')
+    parser.add_argument('--out', help='also write the rows of every file to this csv or .parquet file')
+    parser.add_argument('--workers', type=int, help='parser processes (default: number of CPUs)')
+    parser.add_argument('--check-magic', action='store_true',
+                        help='detect DICOM files by their preamble, including files without a suffix')
+    args = parser.parse_args()
+    cache = ManifestCache(args.cache)
+    start = time.perf_counter()
+    counts = scan(args.dir, cache, args.workers, check_magic=args.check_magic)
+    print('Scanned in %.2fs: %s' % (time.perf_counter() - start, counts))
+    if args.out:
+        print(write_rows(cache.rows(args.dir), args.out), 'rows written to', args.out)
+    cache.close()
+
+if __name__ == '__main__':
+    main()
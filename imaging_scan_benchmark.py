@@ -0,0 +1,252 @@
+"""
+Benchmarks for the DICOM header scan in imaging_data_EDA
+
+By default, times parallel_patient_info over a directory of DICOM files with
+1..N workers and reports files per second and the speed-up over one worker.
+Rows are checked against the serial result so every run returns the same
+data in the same order. The other modes:
+
+    --reads   full reads, reads that stop at the pixel data and header-only
+              reads (read_file): bytes pulled from the OS and time per file
+    --memory  peak Python memory of the list-based extraction (lst_files ->
+              create_ds_list -> patient_info -> DataFrame) against the
+              streaming pipeline (iter_files -> iter_patient_info -> write_rows)
+    --walk    the old os.walk listing against iter_files at each worker
+              count, with and without the DICM magic check, including the
+              time to the first path
+    --series  one row per file against one row per series and per study
+    --stats   extraction with and without PipelineStats, the cost of
+              leaving the instrumentation on
+
+Without --dir a synthetic archive (imaging_fixtures.py) is written to a
+temporary directory first.
+
+Usage: python imaging_scan_benchmark.py [--dir PATH | --files 500] [--workers 1 2 4 8] [--chunksize 16] [--threads]
+       python imaging_scan_benchmark.py --reads [--dir PATH | --files 500] [--size 512]
+       python imaging_scan_benchmark.py --memory [--dir PATH | --files 500] [--batch-size 100]
+       python imaging_scan_benchmark.py --walk [--dir PATH | --files 500] [--workers 1 2 4 8]
+       python imaging_scan_benchmark.py --series [--dir PATH | --files 500]
+       python imaging_scan_benchmark.py --stats [--dir PATH | --files 500]
+"""
+
+import io
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+import pandas as pd
+from pydicom import dcmread
+from imaging_data_EDA import (HEADER_TAGS, lst_files, parallel_patient_info, read_file, patient_info, create_ds_list,
+                              create_dataFrame, iter_files, iter_patient_info, write_rows, unique_rows,
+                              extract_frame, processData, PipelineStats)
+from imaging_fixtures import make_archive
+
+
+class CountingFile(io.FileIO):
+    """File that counts the bytes read from the OS."""
+    bytesRead = 0
+
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        self.bytesRead += count or 0
+        return count
+
+def measure_reads(dirPath):
+    """Compares full and header-only reads of every file and returns a results table.
+
+    :param dirPath: directory of DICOM files
+    :return: dataframe with bytes read and milliseconds per file for each mode
+    """
+    dcm_files = lst_files(dirPath)
+    rows = []
+    results = {}
+    readers = [('full', lambda file: read_file(file, header_only=False)),
+               ('stop before pixels', lambda file: dcmread(file, stop_before_pixels=True, specific_tags=HEADER_TAGS)),
+               ('header only', read_file)]
+    for mode, reader in readers:
+        bytesRead = 0
+        start = time.perf_counter()
+        results[mode] = []
+        for path in dcm_files:
+            raw = CountingFile(path)
+            with io.BufferedReader(raw) as file:
+                results[mode] += patient_info([reader(file)])
+            bytesRead += raw.bytesRead
+        seconds = time.perf_counter() - start
+        rows.append({'read': mode, 'files': len(dcm_files),
+                     'bytes_per_file': round(bytesRead / len(dcm_files)),
+                     'ms_per_file': round(seconds / len(dcm_files) * 1000, 3)})
+        print(rows[-1])
+    if not results['full'] == results['stop before pixels'] == results['header only']:
+        raise AssertionError('header-only reads returned different rows')
+    return pd.DataFrame(rows)
+
+def measure_memory(dirPath, batch_size):
+    """Compares peak traced memory of the list-based and streaming extraction.
+
+    :param dirPath: directory of DICOM files
+    :param batch_size: rows per batch written by the streaming pipeline
+    :return: dataframe with peak MB and seconds for each pipeline
+    """
+    def in_lists(outPath):
+        create_dataFrame(patient_info(create_ds_list(lst_files(dirPath)))).to_csv(outPath, index=False)
+
+    def streamed(outPath):
+        write_rows(iter_patient_info(iter_files(dirPath), workers=1), outPath, batch_size)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as outDir:
+        for name, pipeline in [('lists', in_lists), ('streaming', streamed)]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            pipeline(os.path.join(outDir, name + '.csv'))
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rows.append({'pipeline': name, 'peak_mb': round(peak / 2**20, 2), 'seconds': round(seconds, 3)})
+            print(rows[-1])
+    return pd.DataFrame(rows)
+
+def os_walk_files(dir_path):
+    """The original lst_files: os.walk, lowercase '.dcm' only, whole list built first."""
+    dcm_files = []
+    for root, dirs, files in os.walk(dir_path):
+        for names in files:
+            if names.endswith(".dcm"):
+                dcm_files.append(os.path.join(root, names))
+    return dcm_files
+
+def measure_walk(dirPath, workerCounts):
+    """Times directory walking and returns a results table.
+
+    :param dirPath: directory of DICOM files
+    :param workerCounts: walker thread counts to try
+    :return: dataframe with files found, seconds to the first path and in total for each walker
+    """
+    walkers = [('os.walk', lambda: iter(os_walk_files(dirPath)))]
+    for workers in workerCounts:
+        for check_magic in (False, True):
+            walkers.append(('iter_files workers=%d%s' % (workers, ' magic' if check_magic else ''),
+                            lambda workers=workers, check_magic=check_magic:
+                            iter_files(dirPath, check_magic=check_magic, workers=workers)))
+    rows = []
+    for name, walker in walkers:
+        start = time.perf_counter()
+        paths = walker()
+        first = next(paths, None)
+        firstSeconds = time.perf_counter() - start
+        count = (first is not None) + sum(1 for _ in paths)
+        rows.append({'walker': name, 'files': count, 'first_ms': round(firstSeconds * 1000, 2),
+                     'seconds': round(time.perf_counter() - start, 3)})
+        print(rows[-1])
+    return pd.DataFrame(rows)
+
+def measure_series(dirPath):
+    """Compares one row per file with one row per series and per study (unique_rows).
+
+    :param dirPath: directory of DICOM files
+    :return: dataframe with rows, frame size and seconds for extraction and for the summary
+    """
+    rows = []
+    for level in [None, 'series', 'study']:
+        start = time.perf_counter()
+        patient_rows = iter_patient_info(iter_files(dirPath), workers=1)
+        if level is not None:
+            patient_rows = unique_rows(patient_rows, level)
+        df = extract_frame(patient_rows)
+        seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        processData(df)
+        rows.append({'rows_per': level or 'file', 'rows': len(df),
+                     'frame_kb': round(df.memory_usage(deep=True).sum() / 1024, 1),
+                     'extract_s': round(seconds, 3), 'summary_ms': round((time.perf_counter() - start) * 1000, 2)})
+        print(rows[-1])
+    return pd.DataFrame(rows)
+
+def measure_stats(dirPath, repeat=3):
+    """Compares extraction with and without PipelineStats, to show what leaving it on costs.
+
+    :param dirPath: directory of DICOM files
+    :param repeat: runs of each, the fastest is reported
+    :return: dataframe with files per second for each, and the stats report's stage times
+    """
+    rows = []
+    for instrumented in (False, True):
+        best = float('inf')
+        for _ in range(repeat):
+            stats = PipelineStats() if instrumented else None
+            start = time.perf_counter()
+            dcm_files = iter_files(dirPath)
+            if stats is not None:
+                dcm_files = stats.timed('walk', dcm_files)
+            df = extract_frame(iter_patient_info(dcm_files, workers=1, stats=stats), stats=stats)
+            best = min(best, time.perf_counter() - start)
+        row = {'stats': 'on' if instrumented else 'off', 'files': len(df), 'seconds': round(best, 3),
+               'files_per_s': round(len(df) / best, 1)}
+        if stats is not None:
+            stats.stop()
+            row.update({stage + '_s': round(seconds, 3) for stage, seconds in stats.seconds.items()})
+        rows.append(row)
+        print(row)
+    return pd.DataFrame(rows)
+
+def run(dirPath, workerCounts, chunksize, use_threads):
+    """Times the scan at each worker count and returns a results table."""
+    dcm_files = lst_files(dirPath)
+    expected = parallel_patient_info(dcm_files, workers=1) # serial reference, also warms the page cache
+    rows = []
+    for workers in workerCounts:
+        start = time.perf_counter()
+        result = parallel_patient_info(dcm_files, workers=workers, chunksize=chunksize, use_threads=use_threads)
+        seconds = time.perf_counter() - start
+        if result != expected:
+            raise AssertionError(str(workers) + ' workers returned different rows')
+        rows.append({'workers': workers, 'files': len(dcm_files), 'seconds': round(seconds, 3),
+                     'files_per_s': round(len(dcm_files) / seconds, 1)})
+        print(rows[-1])
+    df = pd.DataFrame(rows)
+    df['speedup'] = (df['files_per_s'] / df['files_per_s'].iloc[0]).round(2)
+    return df
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description='Benchmark the parallel DICOM header scan')
+    parser.add_argument('--dir', help='directory of DICOM files (default: a synthetic archive)')
+    parser.add_argument('--files', type=int, default=500, help='size of the synthetic archive')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1))))
+    parser.add_argument('--chunksize', type=int, default=16)
+    parser.add_argument('--threads', action='store_true', help='use a thread pool instead of processes')
+    parser.add_argument('--reads', action='store_true', help='compare full and header-only reads instead')
+    parser.add_argument('--walk', action='store_true', help='compare directory walkers instead')
+    parser.add_argument('--series', action='store_true', help='compare rows per file, series and study instead')
+    parser.add_argument('--memory', action='store_true', help='compare list-based and streaming extraction instead')
+    parser.add_argument('--stats', action='store_true', help='compare extraction with and without PipelineStats instead')
+    parser.add_argument('--batch-size', type=int, default=100, help='rows per batch written with --memory')
+    parser.add_argument('--size', type=int, default=256, help='image width and height in the synthetic archive')
+    args = parser.parse_args()
+
+    def benchmark(dirPath):
+        if args.reads:
+            return measure_reads(dirPath)
+        if args.memory:
+            return measure_memory(dirPath, args.batch_size)
+        if args.walk:
+            return measure_walk(dirPath, args.workers)
+        if args.series:
+            return measure_series(dirPath)
+        if args.stats:
+            return measure_stats(dirPath)
+        return run(dirPath, args.workers, args.chunksize, args.threads)
+
+    if args.dir:
+        report = benchmark(args.dir)
+    else:
+        with tempfile.TemporaryDirectory() as dirPath:
+            make_archive(dirPath, args.files, args.size)
+            report = benchmark(dirPath)
+    print(report.to_string(index=False))
+
+if __name__ == '__main__':
+    main()
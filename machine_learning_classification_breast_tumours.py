@@ -40,13 +40,21 @@ from matplotlib.pyplot import imshow
 import random
 import sklearn.metrics as metrics
 from sklearn import preprocessing
+from sklearn.utils import Bunch
+from sklearn.base import clone
+import sklearn
+import joblib
+import hashlib
+import time
+import os
 
 
 
 #@title
-# Load dataset function to read csv files
+# Load dataset function to read csv files; floats are parsed exactly as written, so data saved
+# with to_csv reloads bit for bit and keeps its fingerprint (and its cached PCA)
 def load_dataset(path):
-    df = pd.read_csv(path)
+    df = pd.read_csv(path, float_precision='round_trip')
     return df
 
 
@@ -71,49 +79,164 @@ def make_predictions(model, predictors_test, response_test):
     return clf_report + "The AUC score is: " + str(auc_score)
 
 
+# Unfitted classifiers, by the short names used in the voting ensemble
+def make_models():
+    return {'lr': LogisticRegression(random_state=42, max_iter=500),
+            'rf': RandomForestClassifier(n_estimators=100, oob_score=True, random_state=42),
+            'gnb': GaussianNB(),
+            'dt': DecisionTreeClassifier(),
+            'svm': svm.SVC(kernel='linear', probability=True)}
+
+
 # Make Logistic Regression model
 def run_logistic_regression(train_predictors, train_response):
-    clf_lr = LogisticRegression(random_state=42, max_iter=500).fit(train_predictors, train_response)
+    clf_lr = make_models()['lr'].fit(train_predictors, train_response)
     return clf_lr
 
 
 # Make Decision Tree model
 def run_decision_tree(train_predictors, train_response):
-    clf_dt = DecisionTreeClassifier().fit(train_predictors, train_response)
+    clf_dt = make_models()['dt'].fit(train_predictors, train_response)
     return clf_dt
 
 
 # Make Random Forest model
 def run_random_forest(train_predictors, train_response):
-    clf_rf = RandomForestClassifier(n_estimators=100, oob_score=True, random_state=42).fit(train_predictors,
-                                                                                           train_response)
+    clf_rf = make_models()['rf'].fit(train_predictors, train_response)
     return clf_rf
 
 
 # Implement Naive Bayes algortihm
 def run_naive_bayes(train_predictors, train_response):
-    clf_gnb = GaussianNB().fit(train_predictors, train_response)
+    clf_gnb = make_models()['gnb'].fit(train_predictors, train_response)
     return clf_gnb
 
 
 # Implement SVM model with linear kernel
 def run_SVM(train_predictors, train_response):
-    clf_svm = svm.SVC(kernel='linear', probability=True).fit(train_predictors, train_response)
+    clf_svm = make_models()['svm'].fit(train_predictors, train_response)
     return clf_svm
 
 
-# Draw PCA and scree plot for 31 iterations
-def draw_pca_plot(train_predictors):
-    explain_variance_arr = []
-    for i in range(1, 31):
-        pca = decomposition.PCA(n_components=i)
-        pca.fit_transform(train_predictors)
-        explained_variance = pca.explained_variance_ratio_.tolist()
-        explain_variance_arr.append(sum(explained_variance))
-        print(str(i) + "th iteration complete....!")
+# Hash of the training data: values, column names and response
+def data_fingerprint(train_predictors, train_response):
+    digest = hashlib.sha1()
+    digest.update(str(list(getattr(train_predictors, 'columns', []))).encode())
+    for values in (np.asarray(train_predictors), np.asarray(train_response)):
+        values = np.ascontiguousarray(values)
+        digest.update(str((values.shape, values.dtype.str)).encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+# Cache key for an estimator fitted on the fingerprinted data: class, hyperparameters and sklearn version
+def model_key(model, fingerprint):
+    params = sorted(model.get_params(deep=False).items())
+    spec = type(model).__name__ + repr(params) + sklearn.__version__ + fingerprint
+    return hashlib.sha1(spec.encode()).hexdigest()
+
+
+# Fit one estimator and time it; runs in a worker process
+def fit_timed(model, train_predictors, train_response):
+    start = time.perf_counter()
+    model.fit(train_predictors, train_response)
+    return model, time.perf_counter() - start
+
+
+# Fitted estimators by model_key, shared by every fit_models call in the session
+fitted_models = {}
+
+
+# Fit several models concurrently, reusing any already fitted on the same data with the same
+# hyperparameters in this session. With cache_dir, fitted estimators are also saved there as
+# joblib pickles and loaded back by later runs (only point it at a directory you trust).
+# models maps names to unfitted estimators. Returns the fitted estimators by name and a table
+# of fit time per model.
+def fit_models(models, train_predictors, train_response, n_jobs=-1, cache_dir=None):
+    fingerprint = data_fingerprint(train_predictors, train_response)
+    keys = {name: model_key(model, fingerprint) for name, model in models.items()}
+    fitted = {}
+    timings = {}
+    for name, key in keys.items():
+        cachePath = os.path.join(cache_dir, key + '.joblib') if cache_dir else None
+        if key not in fitted_models and cachePath and os.path.isfile(cachePath):
+            fitted_models[key] = joblib.load(cachePath)
+        if key in fitted_models:
+            fitted[name] = fitted_models[key]
+            timings[name] = (0.0, True)
+    pending = [name for name in models if name not in fitted]
+    results = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(fit_timed)(models[name], train_predictors, train_response) for name in pending)
+    for name, (model, seconds) in zip(pending, results):
+        fitted[name] = fitted_models[keys[name]] = model
+        timings[name] = (seconds, False)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            joblib.dump(model, os.path.join(cache_dir, keys[name] + '.joblib'))
+    timing_df = pd.DataFrame([(name, seconds, cached) for name, (seconds, cached) in timings.items()],
+                             columns=['model', 'fit_seconds', 'cached'])
+    return fitted, timing_df
+
+
+# PCA fitted once and kept: explained variance and projections for any number of components come
+# from the stored basis. solver is 'full' (exact), 'randomized' (fast approximation of the leading
+# components) or 'incremental' (fitted batch_size rows at a time, for matrices too large for memory);
+# the last two keep only max_components components.
+class StoredPCA:
+    def __init__(self, solver='full', max_components=None, batch_size=None):
+        if solver == 'full':
+            self.pca = decomposition.PCA(n_components=max_components, svd_solver='full')
+        elif solver == 'randomized':
+            self.pca = decomposition.PCA(n_components=max_components, svd_solver='randomized', random_state=42)
+        elif solver == 'incremental':
+            self.pca = decomposition.IncrementalPCA(n_components=max_components, batch_size=batch_size)
+        else:
+            raise ValueError("Unknown PCA solver " + str(solver))
+
+    def fit(self, train_predictors):
+        self.pca.fit(train_predictors)
+        return self
+
+    # Feed one chunk of rows to an incremental PCA, for data read in pieces
+    def partial_fit(self, chunk):
+        self.pca.partial_fit(chunk)
+        return self
+
+    # Number of components stored
+    def size(self):
+        return self.pca.components_.shape[0]
+
+    # Cumulative explained variance ratio for 1..size() components
+    def cumulative_variance(self):
+        return np.cumsum(self.pca.explained_variance_ratio_)
+
+    # Project predictors onto the first `components` principal components
+    def transform(self, predictors, components):
+        if components > self.size():
+            raise ValueError(str(components) + " components requested, " + str(self.size()) + " stored")
+        return (np.asarray(predictors) - self.pca.mean_) @ self.pca.components_[:components].T
+
+
+# Fitted StoredPCA objects by data fingerprint and solver settings, shared by the PCA functions
+fitted_pcas = {}
+
+
+# StoredPCA for train_predictors, fitted on the first request and reused after that
+def get_pca(train_predictors, solver='full', max_components=None, batch_size=None):
+    key = (data_fingerprint(train_predictors, []), solver, max_components, batch_size)
+    if key not in fitted_pcas:
+        fitted_pcas[key] = StoredPCA(solver, max_components, batch_size).fit(train_predictors)
+    return fitted_pcas[key]
+
+
+# Draw the scree plot of explained variance for 1..30 principal components from a single PCA fit
+def draw_pca_plot(train_predictors, max_components=30, solver='full', batch_size=None):
+    pca = get_pca(train_predictors, solver, None if solver == 'full' else max_components, batch_size)
+    explain_variance_arr = pca.cumulative_variance()[:max_components].tolist()
+    counts = range(1, len(explain_variance_arr) + 1)
 
     plt.figure(figsize=(12, 6))
-    plt.plot(range(1, 31), explain_variance_arr, color='red', linestyle='dashed', marker='o',
+    plt.plot(counts, explain_variance_arr, color='red', linestyle='dashed', marker='o',
              markerfacecolor='blue', markersize=10)
     plt.title('Variance explained by different Principle Components')
     plt.xlabel('Number of Principle Components')
@@ -123,19 +246,52 @@ def draw_pca_plot(train_predictors):
     return explain_variance_arr
 
 
-# Run PCA on model with controlled Principal components
-def run_pca(train_predictors, components):
-    pca = decomposition.PCA(n_components=components)
-    principalComponents = pca.fit_transform(train_predictors)
-    explained_variance = pca.explained_variance_ratio_.tolist()
-    print(sum(explained_variance))
+# Run PCA on model with controlled Principal components, projecting onto the stored basis
+def run_pca(train_predictors, components, solver='full', max_components=None, batch_size=None):
+    pca = get_pca(train_predictors, solver, max_components, batch_size)
+    principalComponents = pca.transform(train_predictors, components)
+    print(pca.cumulative_variance()[components - 1])
     return principalComponents
 
 
-# Make Voting Ensemble Model using others
-def run_voting_ensemble(clf1, clf2, clf3, clf4, train_predictors, test_response):
+# Fit a copy of model on one fold and score it on the held-out rows; runs in a worker process
+def fit_fold(model, predictors, response, train_index, test_index):
+    model.fit(predictors.iloc[train_index], response.iloc[train_index])
+    test_response = response.iloc[test_index]
+    prediction = model.predict(predictors.iloc[test_index])
+    probability = model.predict_proba(predictors.iloc[test_index])[:, 1]
+    fpr, tpr, _ = metrics.roc_curve(test_response, probability)
+    scores = {'accuracy': metrics.accuracy_score(test_response, prediction),
+              'balanced_accuracy': metrics.balanced_accuracy_score(test_response, prediction),
+              'recall': metrics.recall_score(test_response, prediction),
+              'roc_auc': metrics.roc_auc_score(test_response, probability)}
+    return scores, fpr, tpr
+
+
+# Cross-validate model over the folds of cv with one fit per fold, the folds running in parallel.
+# Returns a table of accuracy, balanced accuracy, recall and AUC per fold (all from the same fits)
+# and the (fpr, tpr) ROC curve of each fold.
+def cross_validate_folds(model, predictors, response, cv, n_jobs=-1):
+    results = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(fit_fold)(clone(model), predictors, response, train_index, test_index)
+        for train_index, test_index in cv.split(predictors, response))
+    scores = pd.DataFrame([fold_scores for fold_scores, _, _ in results])
+    rocs = [(fpr, tpr) for _, fpr, tpr in results]
+    return scores, rocs
+
+
+# Make Voting Ensemble Model using others. With prefit=True the four classifiers must already be
+# fitted on train_predictors and are used as they are instead of being cloned and retrained.
+def run_voting_ensemble(clf1, clf2, clf3, clf4, train_predictors, test_response, prefit=False):
     eclf1 = VotingClassifier(estimators=[('lr', clf1), ('rf', clf2), ('gnb', clf3), ('dt', clf4)],
                              voting='soft')
+    if prefit:
+        # the attributes fit() would set, pointing at the fitted members
+        eclf1.le_ = preprocessing.LabelEncoder().fit(test_response)
+        eclf1.classes_ = eclf1.le_.classes_
+        eclf1.estimators_ = [clf1, clf2, clf3, clf4]
+        eclf1.named_estimators_ = Bunch(lr=clf1, rf=clf2, gnb=clf3, dt=clf4)
+        return eclf1
     eclf1 = eclf1.fit(train_predictors, test_response)
     return eclf1
 
@@ -515,14 +671,19 @@ X_train, X_test, y_train, y_test = train_test_split(pca_predictors, response, te
 # y_test = y_test.astype(bool)
 
 # Make classification models
+# fit the four models evaluated below at once across processes; models already fitted on this split are reused
+print("==========================================================================")
+print("Fitting models")
+model_names = ['lr', 'rf', 'gnb', 'dt']
+fitted, fit_times = fit_models({name: make_models()[name] for name in model_names}, X_train, y_train)
+print(fit_times)
+lr_clf, rf_clf, nb_clf, dt_clf = (fitted[name] for name in model_names)
 
 # logistic regression and prediction
 print("==========================================================================")
 print("Running Logistic Regression")
-lr_clf = run_logistic_regression(X_train, y_train)
 print(make_predictions(lr_clf, X_test, y_test))
 # logistic regression ROC
-lr_clf.fit(X_train, y_train)
 metrics.plot_roc_curve(lr_clf, X_test, y_test) 
 plt.title("Logistic Regression ROC Curve") 
 plt.show()
@@ -530,10 +691,8 @@ plt.show()
 # Random Forest and prediction
 print("==========================================================================")
 print("Running Random Forest")
-rf_clf = run_random_forest(X_train, y_train)
 print(make_predictions(rf_clf, X_test, y_test))
 # Random Forest ROC
-rf_clf.fit(X_train, y_train)
 metrics.plot_roc_curve(rf_clf, X_test, y_test)
 plt.title("Random Forest ROC Curve") 
 plt.show()  
@@ -541,10 +700,8 @@ plt.show()
 # Naive Bayes algorithm implementation and prediction
 print("==========================================================================")
 print("Running Naive Bayes")
-nb_clf = run_naive_bayes(X_train, y_train)
 print(make_predictions(nb_clf, X_test, y_test))
 # Naive Bayes ROC
-nb_clf.fit(X_train, y_train)
 metrics.plot_roc_curve(nb_clf, X_test, y_test)  
 plt.title("Naive Bayes ROC Curve") 
 plt.show()  
@@ -552,10 +709,8 @@ plt.show()
 # Decision tree model
 print("==========================================================================")
 print("Running Decision Tree")
-dt_clf = run_decision_tree(X_train, y_train)
 print(make_predictions(dt_clf, X_test, y_test))
 # Decision Tree ROC
-dt_clf.fit(X_train, y_train)
 metrics.plot_roc_curve(dt_clf, X_test, y_test) 
 plt.title("Decision Tree ROC Curve")  
 plt.show()  
@@ -563,10 +718,11 @@ plt.show()
 # Voting Ensemble models with logistic, random forest, naive bayes, and decision tree
 print("==========================================================================")
 print("Running Voting Ensemble")
-ensemble_clf = run_voting_ensemble(lr_clf, rf_clf, nb_clf, dt_clf, X_train, y_train)
+start = time.perf_counter()
+ensemble_clf = run_voting_ensemble(lr_clf, rf_clf, nb_clf, dt_clf, X_train, y_train, prefit=True) # members reused, not refitted
+print("Ensemble assembled in %.4fs" % (time.perf_counter() - start))
 print(make_predictions(ensemble_clf, X_test, y_test))
 # Ensemble ROC
-ensemble_clf.fit(X_train, y_train)
 metrics.plot_roc_curve(ensemble_clf, X_test, y_test)  
 plt.title("Ensemble ROC Curve") 
 plt.show()
@@ -645,21 +801,26 @@ y = response
 kf = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
 kf.get_n_splits(X, y)
 
-# perform Stratified K-Folds cross-validation on Logistic model
-for train_index, test_index in kf.split(X, y):
-    score = cross_val_score(LogisticRegression(random_state=42), X, y, cv=kf, scoring="accuracy")
+# perform Stratified K-Folds cross-validation on Logistic model: one fit per fold, folds in parallel,
+# every metric scored from the same fits
+cv_scores, cv_rocs = cross_validate_folds(LogisticRegression(random_state=42), X, y, kf)
+score = cv_scores['accuracy'].to_numpy()
 print(f'Scores for each fold are: {score}')
 print(f'Average score: {"{:.2f}".format(score.mean())}')
 print(f'Standard deviation: {"{:.2f}".format(score.std())}')
 
 # (changed scoring value to 'balanced_accuracy'): 'balanced_accuracy' deals with imbalanced dataset, but I am not sure if it's necessary to use it after Stratified K Folds
 print('-----------------------------------------------------------------------------------')
-for train_index, test_index in kf.split(X, y):
-    score = cross_val_score(LogisticRegression(random_state=42), X, y, cv=kf, scoring="balanced_accuracy")
+score = cv_scores['balanced_accuracy'].to_numpy()
 print(f'Scores for each fold are: {score}')
 print(f'Average balanced accuracy: {"{:.2f}".format(score.mean())}')
 print(f'Standard deviation: {"{:.2f}".format(score.std())}')
 
+# recall and AUC per fold
+print('-----------------------------------------------------------------------------------')
+print(cv_scores[['recall', 'roc_auc']])
+print(f'Average recall: {"{:.2f}".format(cv_scores["recall"].mean())}, average AUC: {"{:.2f}".format(cv_scores["roc_auc"].mean())}')
+
 """**Stratified K-Fold Cross Validation above:**
 
 After modelling, we used k-fold cross validation to confirm that good evaluation scores produced are not due to randomness. Specifically, Stratified k-fold cross validation is used to preserve the imbalanced class distribution in each fold and to ensure that there are enough examples in the training and testing sets to evaluate the model. Use parameter “scoring = balanced accuracy” to account for the imbalanced dataset. 
@@ -672,15 +833,14 @@ aucs = []
 mean_fpr = np.linspace(0, 1, 100)
 
 fig, ax = plt.subplots()
-for i, (train, test) in enumerate(kf.split(X, y)):
-    lr_clf.fit(X.iloc[train], y.iloc[train])
-    viz = metrics.plot_roc_curve(lr_clf, X.iloc[test], y.iloc[test],
-                         name='ROC fold {}'.format(i),
-                         alpha=0.3, lw=1, ax=ax)
-    interp_tpr = np.interp(mean_fpr, viz.fpr, viz.tpr)
+# ROC curves of the cross-validation fits above, nothing is refitted
+for i, (fpr, tpr) in enumerate(cv_rocs):
+    roc_auc = cv_scores['roc_auc'].iloc[i]
+    ax.plot(fpr, tpr, label='ROC fold {} (AUC = {:.2f})'.format(i, roc_auc), alpha=0.3, lw=1)
+    interp_tpr = np.interp(mean_fpr, fpr, tpr)
     interp_tpr[0] = 0.0
     tprs.append(interp_tpr)
-    aucs.append(viz.roc_auc)
+    aucs.append(roc_auc)
 
 ax.plot([0, 1], [0, 1], linestyle='--', lw=2, color='r',
         label='Chance', alpha=.8)
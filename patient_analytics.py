@@ -0,0 +1,216 @@
+"""
+Occupancy analytics over the census event history
+
+Reads the event history a patient store keeps next to its census
+(<census>.history, see patient_history.py) and computes, per hospital, the
+occupancy after every event and time-bucketed occupancy and capacity
+utilisation (for example the peak ICU occupancy per hospital per hour). Every
+step is a vectorized pass over the event columns: occupancy changes are
+turned into +1/-1 deltas, running occupancy is a cumulative sum per hospital
+and buckets are filled with bincount and maximum.at, so millions of events
+take seconds.
+
+Usage:
+    python patient_analytics.py census.csv [--freq 1h] [--since 2026-10-11] [--until 2026-10-18] [--stat peak]
+    python patient_analytics.py --synthetic 5000000 [--freq 1h]
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from patient_history import EventLog, OPS
+from patient_management_system import read_capacity
+
+# Occupancy change per event type at the event's hospital; transfers also
+# take one patient off fromHospital
+DELTA = np.array([{'census': 1, 'admit': 1, 'transfer': 1, 'status': 0, 'discharge': -1}[op] for op in OPS],
+                 dtype=np.int64)
+
+# Columns the occupancy calculations read from the history
+OCCUPANCY_COLUMNS = ['time', 'op', 'hospital', 'fromHospital']
+
+def to_ns(value):
+    """Converts a timestamp (anything pandas.Timestamp accepts, naive means UTC) to ns since the epoch.
+
+    :param value: timestamp, or None
+    :return: int nanoseconds, or None
+    """
+    if value is None:
+        return None
+    stamp = pd.Timestamp(value)
+    if stamp.tzinfo is None:
+        stamp = stamp.tz_localize('UTC')
+    return stamp.value
+
+def occupancy_deltas(events):
+    """Turns events into occupancy changes.
+
+    :param events: dict of event column arrays (time, op, hospital, fromHospital) in commit order
+    :return: (time, hospital, delta) arrays in commit order, transfers giving a -1 at fromHospital
+        followed by a +1 at hospital
+    """
+    delta = DELTA[events['op']]
+    moved = (delta != 0) & (events['hospital'] >= 0)
+    transfer = moved & (events['op'] == OPS.index('transfer')) & (events['fromHospital'] >= 0)
+    # every event that moves occupancy takes one slot, transfers two
+    slots = np.cumsum(moved.astype(np.int64) + transfer) - 1
+    size = int(slots[-1]) + 1 if len(slots) else 0
+    times = np.empty(size, dtype=np.int64)
+    hospitals = np.empty(size, dtype=np.int32)
+    deltas = np.empty(size, dtype=np.int64)
+    times[slots[moved]] = events['time'][moved]
+    hospitals[slots[moved]] = events['hospital'][moved]
+    deltas[slots[moved]] = delta[moved]
+    left = slots[transfer] - 1
+    times[left] = events['time'][transfer]
+    hospitals[left] = events['fromHospital'][transfer]
+    deltas[left] = -1
+    return times, hospitals, deltas
+
+def running_occupancy(hospitals, deltas):
+    """Occupancy of each change's hospital just after it, as a cumulative sum per hospital.
+
+    :param hospitals: hospital code per change
+    :param deltas: +1/-1 per change, in commit order
+    :return: occupancy array aligned with the changes
+    """
+    order = np.argsort(hospitals, kind='stable')
+    sums = np.cumsum(deltas[order])
+    sortedHospitals = hospitals[order]
+    starts = np.flatnonzero(np.r_[True, sortedHospitals[1:] != sortedHospitals[:-1]])
+    before = sums[starts] - deltas[order][starts] # total of earlier hospitals' changes
+    lengths = np.diff(np.r_[starts, len(order)])
+    levels = np.empty(len(order), dtype=np.int64)
+    levels[order] = sums - np.repeat(before, lengths)
+    return levels
+
+def occupancy_timeline(events, names):
+    """Occupancy after every change, one row per hospital per change.
+
+    :param events: dict of event column arrays
+    :param names: the history's name table (hospital code -> name)
+    :return: dataframe with time, Hospital and Occupancy columns
+    """
+    times, hospitals, deltas = occupancy_deltas(events)
+    return pd.DataFrame({'time': pd.to_datetime(times, unit='ns', utc=True),
+                         'Hospital': pd.Categorical.from_codes(hospitals, categories=names),
+                         'Occupancy': running_occupancy(hospitals, deltas)})
+
+def occupancy_series(events, names, freq='1h', start=None, end=None, stat='peak'):
+    """Occupancy per hospital per time bucket.
+
+    Changes before `start` only set the occupancy the first bucket opens with,
+    and a bucket with no changes carries the previous bucket's closing value.
+
+    :param events: dict of event column arrays covering the whole history
+    :param names: the history's name table (hospital code -> name)
+    :param freq: bucket width, e.g. '15min', '1h', '1D'; buckets are aligned to the epoch
+    :param start: first bucket includes this time (default: first event)
+    :param end: last bucket includes this time (default: last event)
+    :param stat: 'peak' for the highest occupancy reached in the bucket,
+        'close' for the occupancy at its end
+    :return: dataframe indexed by bucket start (UTC) with a column per hospital
+    """
+    times, hospitals, deltas = occupancy_deltas(events)
+    width = pd.Timedelta(freq).value
+    start = to_ns(start) if start is not None else (int(times.min()) if len(times) else 0)
+    end = to_ns(end) if end is not None else (int(times.max()) if len(times) else start)
+    origin = start - start % width
+    count = int((end - origin) // width) + 1
+    hospitalCount = len(names)
+
+    before = times < origin
+    opening = np.bincount(hospitals[before], weights=deltas[before], minlength=hospitalCount).astype(np.int64)
+    inRange = ~before & (times < origin + count * width)
+    buckets = (times[inRange] - origin) // width
+    cells = buckets * hospitalCount + hospitals[inRange]
+    changes = np.bincount(cells, weights=deltas[inRange], minlength=count * hospitalCount)
+    close = opening + np.cumsum(changes.reshape(count, hospitalCount).astype(np.int64), axis=0)
+    if stat == 'close':
+        values = close
+    elif stat == 'peak':
+        values = np.vstack([opening, close[:-1]]) # occupancy each bucket opens with
+        levels = running_occupancy(hospitals, deltas)[inRange]
+        np.maximum.at(values.reshape(-1), cells, levels)
+    else:
+        raise ValueError("Unknown stat " + str(stat))
+    index = pd.to_datetime(origin + np.arange(count, dtype=np.int64) * width, unit='ns', utc=True)
+    return pd.DataFrame(values, index=index, columns=names)
+
+def utilisation(series, capacity):
+    """Occupancy as a fraction of each hospital's ICU capacity.
+
+    :param series: output of occupancy_series
+    :param capacity: dict of hospital -> capacity
+    :return: dataframe like `series`; hospitals with no capacity entry are dropped
+    """
+    hospitals = [hospital for hospital in series.columns if capacity.get(hospital)]
+    return series[hospitals] / pd.Series({hospital: capacity[hospital] for hospital in hospitals})
+
+def hospital_columns(series, history):
+    """Drops columns for names that are not hospitals (the name table also holds statuses)."""
+    events = history.read(['hospital', 'fromHospital'])
+    used = np.union1d(events['hospital'], events['fromHospital'])
+    return series[[history.names[code] for code in used if code >= 0]]
+
+def census_report(filePath, freq='1h', start=None, end=None, stat='peak', capacityPath=None):
+    """Occupancy and utilisation per hospital per bucket from a census's history.
+
+    :param filePath: census the history belongs to (.csv or .db)
+    :param capacityPath: hospital capacity CSV, default hospital_capacity.csv next to the census
+    :return: (occupancy dataframe, utilisation dataframe)
+    """
+    history = EventLog(filePath + '.history')
+    if not history.exists():
+        raise FileNotFoundError("No history for " + filePath)
+    if capacityPath is None:
+        capacityPath = os.path.join(os.path.dirname(filePath), 'hospital_capacity.csv')
+    events = history.read(OCCUPANCY_COLUMNS)
+    series = hospital_columns(occupancy_series(events, history.names, freq, start, end, stat), history)
+    return series, utilisation(series, read_capacity(capacityPath))
+
+def synthetic_events(count, hospitals=('Toronto', 'Hamilton', 'Kingston'), days=7):
+    """Random event columns for timing; admissions outnumber discharges so occupancy drifts upward.
+
+    :param count: number of events
+    :param hospitals: hospital names, coded 0..n-1
+    :param days: span of the event times, ending now
+    :return: (events dict, names list)
+    """
+    end = time.time_ns()
+    times = np.sort(np.random.randint(end - days * 86400 * 10**9, end, size=count, dtype=np.int64))
+    ops = np.random.choice([OPS.index(op) for op in ['admit', 'transfer', 'status', 'discharge']],
+                           size=count, p=[0.4, 0.2, 0.1, 0.3]).astype(np.int8)
+    events = {'time': times, 'op': ops,
+              'hospital': np.random.randint(0, len(hospitals), size=count).astype(np.int32),
+              'fromHospital': np.random.randint(0, len(hospitals), size=count).astype(np.int32)}
+    return events, list(hospitals)
+
+def main():
+    parser = argparse.ArgumentParser(description='Occupancy analytics from the census event history')
+    parser.add_argument('census', nargs='?', help='census (.csv or .db) whose history to read')
+    parser.add_argument('--freq', default='1h', help='bucket width (pandas offset, e.g. 15min, 1h, 1D)')
+    parser.add_argument('--since', help='first bucket includes this time (UTC)')
+    parser.add_argument('--until', help='last bucket includes this time (UTC)')
+    parser.add_argument('--stat', choices=['peak', 'close'], default='peak')
+    parser.add_argument('--synthetic', type=int, metavar='N',
+                        help='time the analytics on N random events instead of reading a census')
+    args = parser.parse_args()
+    if args.synthetic:
+        events, names = synthetic_events(args.synthetic)
+        start = time.perf_counter()
+        series = occupancy_series(events, names, args.freq, args.since, args.until, args.stat)
+        print('%d events -> %d buckets in %.2fs' % (args.synthetic, len(series), time.perf_counter() - start))
+        print(series.tail().to_string())
+        return
+    if args.census is None:
+        parser.error('a census or --synthetic is required')
+    series, used = census_report(args.census, args.freq, args.since, args.until, args.stat)
+    print(series.to_string())
+    print('\nUtilisation:')
+    print(used.round(2).to_string())
+
+if __name__ == '__main__':
+    main()
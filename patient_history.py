@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import itertools
+import numpy as np
+import pandas as pd
+
+# Event types, stored as their position in this list. 'census' events record
+# the patients already present when the history was started.
+OPS = ['census', 'admit', 'transfer', 'status', 'discharge']
+
+# Bytes kept for a Patient_ID when a history is created. Logging a longer ID
+# rewrites the patient column at the new width, named after it (patient.S40).
+PATIENT_WIDTH = 24
+
+# One file per column, appended to independently so analytics can read only
+# the columns it needs. hospital is where the patient is after the event (the
+# hospital left, for a discharge), fromHospital the hospital a transfer left
+# and status the patient's status after the event. Hospitals and statuses are
+# codes into the log's name table, -1 for none.
+COLUMNS = {'time': np.dtype('<i8'), 'op': np.dtype('i1'), 'patient': np.dtype('S' + str(PATIENT_WIDTH)),
+           'hospital': np.dtype('<i4'), 'fromHospital': np.dtype('<i4'), 'status': np.dtype('<i4')}
+
+# Written last so a reader never sees a time for a partly appended event
+APPEND_ORDER = ['patient', 'status', 'fromHospital', 'hospital', 'op', 'time']
+
+
+# History event for a store operation, given the patient's record before it
+# is applied (None if unknown). Returns (op, patientID, hospital,
+# fromHospital, status), or None for an operation that changes nothing.
+def entry_event(entry, current):
+    op, patientID = entry[0], entry[1]
+    if op == 'add':
+        return ('admit', patientID, entry[2], None, entry[3])
+    if current is None:
+        return None
+    hospital, status = list(current.values())[1:3]
+    if op == 'transfer':
+        return ('transfer', patientID, entry[2], hospital, status)
+    if op == 'status':
+        return ('status', patientID, hospital, None, entry[2])
+    return ('discharge', patientID, hospital, None, status)
+
+
+class EventLog:
+    # Append-only, timestamped history of census changes kept as one file per
+    # column in a directory next to the census. Stores append to it while they
+    # hold their write lock, so events from several processes are written one
+    # batch at a time in commit order. Times are nanoseconds since the epoch.
+    def __init__(self, dirPath, clock=time.time_ns):
+        self.dirPath = dirPath
+        self.namesPath = os.path.join(dirPath, 'names.jsonl')
+        self.clock = clock
+        self.fds = {}
+        self.names = []
+        self.nameCodes = {}
+        self.patientDtype = COLUMNS['patient']
+
+    def dtype(self, col):
+        return self.patientDtype if col == 'patient' else COLUMNS[col]
+
+    def column_path(self, col):
+        return os.path.join(self.dirPath, col + '.' + self.dtype(col).str.lstrip('<|'))
+
+    # Widths of the patient column files in the directory; more than one only
+    # if a widening was interrupted before the narrower file was removed
+    def patient_widths(self):
+        names = os.listdir(self.dirPath) if os.path.isdir(self.dirPath) else []
+        return sorted(int(name[len('patient.S'):]) for name in names
+                      if name.startswith('patient.S') and name[len('patient.S'):].isdigit())
+
+    # Follow a widening of the patient column by another process
+    def sync_patient_column(self):
+        if os.path.isfile(self.column_path('patient')):
+            return
+        widths = self.patient_widths()
+        self.patientDtype = np.dtype('S' + str(widths[-1] if widths else PATIENT_WIDTH))
+        if 'patient' in self.fds:
+            os.close(self.fds['patient'])
+            self.fds['patient'] = os.open(self.column_path('patient'), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+
+    # Rewrite the patient column at a larger width; caller holds the store's
+    # write lock. The wider file is complete before the narrower one goes.
+    def widen_patient_column(self, width):
+        oldPath = self.column_path('patient')
+        patients = np.fromfile(oldPath, dtype=self.patientDtype)
+        self.patientDtype = np.dtype('S' + str(width))
+        tmpPath = os.path.join(self.dirPath, 'patient.tmp')
+        patients.astype(self.patientDtype).tofile(tmpPath)
+        os.replace(tmpPath, self.column_path('patient'))
+        os.close(self.fds['patient'])
+        self.fds['patient'] = os.open(self.column_path('patient'), os.O_RDWR | os.O_APPEND)
+        os.remove(oldPath)
+
+    def exists(self):
+        return os.path.isfile(self.namesPath)
+
+    # Create or reopen the log; caller holds the store's write lock. Columns
+    # left at different lengths by an interrupted append are cut back to the
+    # last complete event.
+    def open(self):
+        os.makedirs(self.dirPath, exist_ok=True)
+        open(self.namesPath, 'a').close()
+        widths = self.patient_widths()
+        if widths:
+            self.patientDtype = np.dtype('S' + str(widths[-1]))
+            for width in widths[:-1]:
+                os.remove(os.path.join(self.dirPath, 'patient.S' + str(width)))
+        for col in COLUMNS:
+            self.fds[col] = os.open(self.column_path(col), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        count = len(self)
+        for col, fd in self.fds.items():
+            os.ftruncate(fd, count * self.dtype(col).itemsize)
+        self.load_names()
+
+    # Read names added since the last call, including those added by other processes
+    def load_names(self):
+        with open(self.namesPath) as namesFile:
+            for line in itertools.islice(namesFile, len(self.names), None):
+                try:
+                    name = json.loads(line)
+                except ValueError:
+                    break # torn write at the end of the table
+                self.nameCodes[name] = len(self.names)
+                self.names.append(name)
+
+    # Code for a hospital or status name, adding it to the table if unseen
+    def code(self, name):
+        if name is None:
+            return -1
+        code = self.nameCodes.get(name)
+        if code is None:
+            self.load_names()
+            code = self.nameCodes.get(name)
+        if code is None:
+            with open(self.namesPath, 'a') as namesFile:
+                namesFile.write(json.dumps(name) + '\n')
+            code = self.nameCodes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    # Number of complete events
+    def __len__(self):
+        self.sync_patient_column()
+        sizes = [os.path.getsize(self.column_path(col)) // self.dtype(col).itemsize
+                 if os.path.isfile(self.column_path(col)) else 0 for col in COLUMNS]
+        return min(sizes)
+
+    # Append (op, patientID, hospital, fromHospital, status) events, all
+    # stamped with the current time; caller holds the store's write lock
+    def append(self, events):
+        if not events:
+            return
+        ops, patientIDs, hospitals, fromHospitals, statuses = zip(*events)
+        self.sync_patient_column()
+        patients = np.array([str(patientID).encode() for patientID in patientIDs])
+        if patients.dtype.itemsize > self.patientDtype.itemsize:
+            self.widen_patient_column(patients.dtype.itemsize)
+        arrays = {'time': np.full(len(events), self.clock(), dtype=COLUMNS['time']),
+                  'op': np.array([OPS.index(op) for op in ops], dtype=COLUMNS['op']),
+                  'patient': patients.astype(self.patientDtype),
+                  'hospital': np.array([self.code(name) for name in hospitals], dtype=COLUMNS['hospital']),
+                  'fromHospital': np.array([self.code(name) for name in fromHospitals],
+                                           dtype=COLUMNS['fromHospital']),
+                  'status': np.array([self.code(name) for name in statuses], dtype=COLUMNS['status'])}
+        for col in APPEND_ORDER:
+            os.write(self.fds[col], arrays[col].tobytes())
+
+    # Events as a {column: array} dict, optionally only some columns and only
+    # events with start <= time < end (nanoseconds). Events are in commit order.
+    def read(self, columns=None, start=None, end=None):
+        count = len(self)
+        columns = list(columns or COLUMNS)
+        if start is not None or end is not None:
+            times = np.fromfile(self.column_path('time'), dtype=COLUMNS['time'], count=count)
+            keep = np.ones(count, dtype=bool)
+            if start is not None:
+                keep &= times >= start
+            if end is not None:
+                keep &= times < end
+        else:
+            keep = None
+        events = {}
+        for col in columns:
+            values = np.fromfile(self.column_path(col), dtype=self.dtype(col), count=count)
+            events[col] = values if keep is None else values[keep]
+        self.load_names()
+        return events
+
+    # Events as a DataFrame with decoded names and a UTC timestamp column
+    def to_frame(self, start=None, end=None):
+        events = self.read(start=start, end=end)
+        names = self.names + [None] # code -1 picks the last slot
+        return pd.DataFrame({
+            'time': pd.to_datetime(events['time'], unit='ns', utc=True),
+            'op': pd.Categorical.from_codes(events['op'], categories=OPS),
+            'Patient_ID': np.char.decode(events['patient']),
+            'Hospital': pd.Categorical(np.array(names, dtype=object)[events['hospital']]),
+            'From_Hospital': pd.Categorical(np.array(names, dtype=object)[events['fromHospital']]),
+            'Status': pd.Categorical(np.array(names, dtype=object)[events['status']])})
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
@@ -0,0 +1,161 @@
+"""
+Load generator for the patient HTTP service
+
+Opens a number of keep-alive connections to patient_service.py and sends a
+mix of admissions, transfers, status updates, discharges and reads, then
+reports throughput and p50/p99 latency per request type.
+
+With --self-host the service is started in-process on a free localhost port
+against a synthetic census in a temporary directory, so no other setup is
+needed.
+
+Usage:
+    python patient_load_generator.py --self-host [--requests 5000] [--connections 20]
+    python patient_load_generator.py --url http://127.0.0.1:8080
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from urllib.parse import urlparse
+import numpy as np
+import pandas as pd
+from patient_service import PatientService
+
+HOSPITALS = ['Toronto', 'Hamilton', 'Kingston']
+
+# Request mix: type -> share of requests
+MIX = {'admit': 0.2, 'transfer': 0.15, 'status': 0.15, 'discharge': 0.1,
+       'occupancy': 0.3, 'patients': 0.1}
+
+
+class Client:
+    """One keep-alive HTTP connection to the service."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, payload=None):
+        """Sends a request and returns (status, decoded JSON body)."""
+        body = json.dumps(payload).encode() if payload is not None else b''
+        head = (method + ' ' + path + ' HTTP/1.1\r\nHost: ' + self.host + '\r\n'
+                'Content-Type: application/json\r\nContent-Length: ' + str(len(body)) + '\r\n\r\n')
+        self.writer.write(head.encode('latin-1') + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        self.writer.close()
+
+
+async def worker(client, count, admitted, latencies):
+    """Sends `count` requests drawn from MIX, recording latency per type.
+
+    :param client: connected Client
+    :param count: number of requests to send
+    :param admitted: shared list of Patient_IDs known to exist
+    :param latencies: dict of request type -> list of seconds
+    """
+    kinds = random.choices(list(MIX), weights=list(MIX.values()), k=count)
+    for kind in kinds:
+        if kind in ('transfer', 'status', 'discharge') and not admitted:
+            kind = 'admit'
+        start = time.perf_counter()
+        if kind == 'admit':
+            status, body = await client.request('POST', '/patients', {
+                'hospital': random.choice(HOSPITALS), 'status': 'critical', 'covid': 'yes'})
+            if status == 201:
+                admitted.append(body['Patient_ID'])
+        elif kind == 'transfer':
+            await client.request('POST', '/patients/' + random.choice(admitted) + '/transfer',
+                                 {'hospital': random.choice(HOSPITALS)})
+        elif kind == 'status':
+            await client.request('POST', '/patients/' + random.choice(admitted) + '/status',
+                                 {'status': 'stable'})
+        elif kind == 'discharge':
+            patientID = admitted.pop(random.randrange(len(admitted)))
+            await client.request('DELETE', '/patients/' + patientID)
+        else:
+            await client.request('GET', '/' + kind)
+        latencies.setdefault(kind, []).append(time.perf_counter() - start)
+
+
+async def generate_load(host, port, requests, connections):
+    """Runs the load and returns a DataFrame of latency percentiles per request type."""
+    clients = [Client(host, port) for _ in range(connections)]
+    await asyncio.gather(*(client.connect() for client in clients))
+    admitted = []
+    latencies = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(client, requests // connections, admitted, latencies) for client in clients))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.close()
+
+    rows = []
+    for kind, seconds in sorted(latencies.items()) + [('all', sum(latencies.values(), []))]:
+        ms = np.array(seconds) * 1000
+        rows.append({'request': kind, 'count': len(ms), 'p50_ms': round(float(np.percentile(ms, 50)), 2),
+                     'p99_ms': round(float(np.percentile(ms, 99)), 2), 'max_ms': round(float(ms.max()), 2)})
+    print('%d requests over %d connections in %.2fs (%.0f req/s)' % (
+        len(sum(latencies.values(), [])), connections, elapsed, len(sum(latencies.values(), [])) / elapsed))
+    return pd.DataFrame(rows)
+
+
+async def self_hosted(requests, connections, patients):
+    """Starts the service on a synthetic census and runs the load against it."""
+    with tempfile.TemporaryDirectory() as dirPath:
+        filePath = os.path.join(dirPath, 'census.csv')
+        pd.DataFrame({'Patient_ID': ['b' + str(i).zfill(7) for i in range(patients)],
+                      'Hospital': random.choices(HOSPITALS, k=patients),
+                      'Status': 'stable', 'Covid_Positive': 'no'}).to_csv(filePath, sep=',')
+        pd.DataFrame({'Hospital': HOSPITALS, 'Capacity': [patients + requests] * len(HOSPITALS)}).to_csv(
+            os.path.join(dirPath, 'hospital_capacity.csv'), index=False)
+        service = PatientService(filePath)
+        server = await service.serve('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await generate_load('127.0.0.1', port, requests, connections)
+        finally:
+            server.close()
+            await server.wait_closed()
+            await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for patient_service.py')
+    parser.add_argument('--url', default='http://127.0.0.1:8080', help='service to load')
+    parser.add_argument('--self-host', action='store_true',
+                        help='start the service in-process on a synthetic census instead of using --url')
+    parser.add_argument('--patients', type=int, default=1000, help='census size with --self-host')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--connections', type=int, default=20)
+    args = parser.parse_args()
+    if args.self_host:
+        report = asyncio.run(self_hosted(args.requests, args.connections, args.patients))
+    else:
+        url = urlparse(args.url)
+        report = asyncio.run(generate_load(url.hostname, url.port or 80, args.requests, args.connections))
+    print(report.to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,11 @@
 import random
 import string
 import os
+import sys
+import shlex
+import argparse
 import pandas as pd
+from patient_store import open_store, parse_covid, ConflictError, COVID_TRUE, COVID_FALSE
 
 #"C:\\Users\\Vins\\Desktop\\MBI_Courses\\BMIF_801\\mini_project\\initial_hospital_state.csv"
 # get file path
@@ -39,134 +43,388 @@ def getUserChoice():
         else:
             print("Try again.")
 
+# ICU capacity used when there is no hospital_capacity.csv next to the census
+DEFAULT_CAPACITY = {'Toronto': 20, 'Hamilton': 13, 'Kingston': 10}
+
+# Read the Hospital,Capacity table, falling back to DEFAULT_CAPACITY
+def read_capacity(capacityPath):
+    if not os.path.isfile(capacityPath):
+        return dict(DEFAULT_CAPACITY)
+    df = pd.read_csv(capacityPath)
+    return dict(zip(df['Hospital'], df['Capacity'].astype(int)))
+
+
+# Hands out patient IDs from a counter: a prefix followed by a zero-padded
+# sequence number (P00000001, P00000002, ...). The counter starts after the
+# highest such ID already in the store, and any ID the store already holds
+# (e.g. admitted by another process) is skipped, so every ID is unique.
+class SequenceIdGenerator:
+    def __init__(self, prefix='P', width=8):
+        self.prefix = prefix
+        self.width = width
+        self.next = None
+
+    # Highest sequence number in use, read once from the store
+    def seed(self, store):
+        highest = 0
+        for patientID in store.ids():
+            patientID = str(patientID)
+            if patientID.startswith(self.prefix) and patientID[len(self.prefix):].isdigit():
+                highest = max(highest, int(patientID[len(self.prefix):]))
+        self.next = highest + 1
+
+    # Return `count` IDs that are not in the store
+    def next_ids(self, store, count=1):
+        if self.next is None:
+            self.seed(store)
+        ids = []
+        while len(ids) < count:
+            id = self.prefix + str(self.next).zfill(self.width)
+            self.next += 1
+            if id not in store:
+                ids.append(id)
+        return ids
+
+
+# Draws random IDs of `length` digits and lowercase letters, redrawing any
+# that are already in the store or in the same batch
+class RandomIdGenerator:
+    def __init__(self, length=8):
+        self.length = length
+
+    def next_ids(self, store, count=1):
+        ids = set()
+        while len(ids) < count:
+            id = ''.join(random.choices(string.digits + string.ascii_lowercase, k=self.length))
+            if id not in store:
+                ids.add(id)
+        return list(ids)
+
+
 class PatientManagementSystem:
-    # Read inital CSV file
-    def read_hospital_csv(self,filePath):
-        df = pd.read_csv(filePath) # file path may differ
-        df = df.iloc[:, 1:] # ignore index column
-        return df
-
-    # Group data by hospital
-    def group_by_hospital(self, df):
-        grouped_df = df.groupby(['Hospital']).size().to_frame()
-        grouped_df.reset_index(level=0, inplace=True)
-        grouped_df.columns = ['Hospitals', 'NumberOfPatients']
+    def __init__(self, filePath, capacityPath=None, idGenerator=None):
+        self.store = open_store(filePath)
+        self.idGenerator = idGenerator or SequenceIdGenerator()
+        if capacityPath is None:
+            capacityPath = os.path.join(os.path.dirname(filePath), 'hospital_capacity.csv')
+        self.capacity = read_capacity(capacityPath)
+
+    # True if the hospital is known and has a free ICU bed
+    def has_capacity(self, hospitalName):
+        return self.store.occupancy(hospitalName) < self.capacity.get(hospitalName, 0)
+
+    # Current census as a DataFrame
+    def patients(self):
+        return self.store.to_frame()
+
+    # Stream patient records (dicts), optionally filtered by hospital, status
+    # and covid flag, sorted by a column, and paged with offset/limit
+    def list_patients(self, hospital=None, status=None, covid=None, sortBy=None, descending=False,
+                      offset=0, limit=None):
+        return self.store.iter_patients(hospital, status, covid, sortBy, descending, offset, limit)
+
+    # Number of patients per hospital, read from the store's occupancy counts
+    def group_by_hospital(self):
+        counts = self.store.counts()
+        hospitals = sorted(set(self.capacity) | set(counts))
+        grouped_df = pd.DataFrame({'Hospitals': hospitals,
+                                   'NumberOfPatients': [counts.get(h, 0) for h in hospitals]})
         return grouped_df
 
-    # Function for adding a patient
+    # Generate a patientID that is not in the census
+    def new_patient_id(self):
+        return self.idGenerator.next_ids(self.store)[0]
+
+    # Accept rows in order while each hospital still has beds left;
+    # `target` names the hospital column and `ok` masks rows still eligible
+    def check_capacity(self, ops, target, ok):
+        rank = ops[target].where(ok).to_frame().groupby(target).cumcount()
+        occupancy = ops[target].map(self.store.counts()).fillna(0)
+        capacity = ops[target].map(self.capacity).fillna(0)
+        return ok & (occupancy + rank.reindex(ops.index, fill_value=0) < capacity)
+
+    # Admit many patients at once. `ops` is a DataFrame (or list of dicts) with
+    # Hospital, Status and covid columns; returns it with Patient_ID, Accepted
+    # and Reason columns. Accepted rows are persisted in a single transaction.
+    def add_patients(self, ops):
+        ops = pd.DataFrame(ops).reset_index(drop=True)
+        covidCol = self.store.columns[3]
+        if ops.empty:
+            return pd.DataFrame(ops, columns=['Hospital', 'Status', covidCol, 'Reason', 'Accepted', 'Patient_ID'])
+        with self.store.transaction():
+            known = ops['Hospital'].isin(list(self.capacity))
+            validCovid = ops[covidCol].map(lambda value: str(value).strip().lower()).isin(COVID_TRUE | COVID_FALSE)
+            accepted = self.check_capacity(ops, 'Hospital', known & validCovid)
+            ops['Reason'] = ''
+            ops.loc[~validCovid, 'Reason'] = 'invalid covid flag'
+            ops.loc[~known, 'Reason'] = 'unknown hospital'
+            ops.loc[known & validCovid & ~accepted, 'Reason'] = 'hospital full'
+            ops['Accepted'] = accepted
+            ops['Patient_ID'] = None
+            ops.loc[accepted, 'Patient_ID'] = self.idGenerator.next_ids(self.store, int(accepted.sum()))
+            admitted = ops[accepted]
+            entries = [['add', id, hospital, status, covid] for id, hospital, status, covid
+                       in zip(admitted['Patient_ID'], admitted['Hospital'], admitted['Status'], admitted[covidCol])]
+            self.store.commit_many(entries)
+        return ops
+
+    # Transfer many patients at once. `ops` has Patient_ID and Hospital (the
+    # new hospital) columns; returns it with Accepted and Reason columns.
+    # Beds freed by transfers in the same batch are not reused by it.
+    def transfer_patients(self, ops):
+        ops = pd.DataFrame(ops).reset_index(drop=True)
+        if ops.empty:
+            return pd.DataFrame(ops, columns=['Patient_ID', 'Hospital', 'Reason', 'Accepted'])
+        with self.store.transaction():
+            known = ops['Patient_ID'].map(self.store.__contains__).astype(bool)
+            first = ~ops['Patient_ID'].duplicated()
+            knownHospital = ops['Hospital'].isin(list(self.capacity))
+            accepted = self.check_capacity(ops, 'Hospital', known & first & knownHospital)
+            ops['Reason'] = ''
+            ops.loc[~knownHospital, 'Reason'] = 'unknown hospital'
+            ops.loc[~first, 'Reason'] = 'duplicate in batch'
+            ops.loc[~known, 'Reason'] = 'unknown patient'
+            ops.loc[known & first & knownHospital & ~accepted, 'Reason'] = 'hospital full'
+            ops['Accepted'] = accepted
+            entries = [['transfer', patientID, hospital]
+                       for patientID, hospital in zip(ops.loc[accepted, 'Patient_ID'], ops.loc[accepted, 'Hospital'])]
+            self.store.commit_many(entries)
+        return ops
+
+    # Function for adding a patient, returns the new patient's record or None if the hospital is full
     def add_patient(self, hospitalName, sevStatus, covidPositive):
-        nums = random.choices(string.digits, k=3) # return 3 random numbers
-        alpha = random.choices(string.ascii_lowercase, k=1) # return random lowercase letter
-        id = ''.join(nums + alpha) # create patientID
-        df = self.read_hospital_csv()
-        grouped_df = self.group_by_hospital(df)
-        print(grouped_df)
-        x = int(grouped_df[grouped_df['Hospitals'] == hospitalName]['NumberOfPatients'])
-        if hospitalName == 'Toronto' and x < 20:
-            df.loc[len(df)] = [id, hospitalName, sevStatus, covidPositive]
-            df.to_csv("initial_hospital_state.csv", sep=',')
-        elif hospitalName == 'Hamilton' and x < 13:
-            df.loc[len(df)] = [id, hospitalName, sevStatus, covidPositive]
-            df.to_csv("initial_hospital_state.csv", sep=',')
-        elif hospitalName == 'Kingston' and x < 10:
-            df.loc[len(df)] = [id, hospitalName, sevStatus, covidPositive]
-            df.to_csv("initial_hospital_state.csv", sep=',')
-        else:
-            print("Cannot transfer to " + hospitalName + " Hospital as the ICU at " + hospitalName + " is full.")
-            print("Please transfer to another hospital")
-            newHospitalName_2 = input('Enter the new hospital')
-            self.add_patient(newHospitalName_2, sevStatus, covidPositive)
-        main() # run main again
+        with self.store.transaction(): # capacity check and admission are atomic
+            if not self.has_capacity(hospitalName):
+                return None
+            id = self.new_patient_id()
+            self.store.add(id, hospitalName, sevStatus, covidPositive)
+        return self.store.get(id)
 
-    # Function for transfering a patient
+    # Function for transfering a patient, returns the updated record or None if the new hospital is full
     def transfer_patient(self, patientID, newHospitalName):
-        df = self.read_hospital_csv()
-        grouped_df = self.group_by_hospital(df)
-
-        x = int(grouped_df[grouped_df['Hospitals'] == newHospitalName]['NumberOfPatients'])
-        print(x)
-        if newHospitalName == 'Toronto' and x < 20:
-            df = self.read_hospital_csv()
-            df.loc[df.Patient_ID == patientID, 'Hospital'] = newHospitalName
-            print(df)
-            df.to_csv("initial_hospital_state.csv", sep=',')
-        elif newHospitalName == 'Hamilton' and x < 13:
-            df = self.read_hospital_csv()
-            df.loc[df.Patient_ID == patientID, 'Hospital'] = newHospitalName
-            print(df)
-            df.to_csv("initial_hospital_state.csv", sep=',')
-        elif newHospitalName == 'Kingston' and x < 10:
-            df = self.read_hospital_csv()
-            df.loc[df.Patient_ID == patientID, 'Hospital'] = newHospitalName
-            print(df)
-            df.to_csv("initial_hospital_state.csv", sep=',')
-        else:
-            print("Cannot transfer to " + newHospitalName + " Hospital as the ICU at " + newHospitalName + " are full.")
-            print("Please transfer to another hospital")
-            newHospitalName_2 = input('Enter the new hospital')
-            self.transfer_patient(patientID, newHospitalName_2)
-        main()
+        with self.store.transaction(): # capacity check and transfer are atomic
+            if patientID not in self.store:
+                raise KeyError(patientID)
+            if not self.has_capacity(newHospitalName):
+                return None
+            self.store.transfer(patientID, newHospitalName)
+        return self.store.get(patientID)
 
-    # Function for discharging a patient
+    # Function for discharging a patient, returns the discharged record
     def discharge_patient(self, pateintID):
-        df = self.read_hospital_csv()
-        df.drop(df[df.Patient_ID == pateintID].index, inplace=True)
-        df.reset_index(drop=True)
-        df.to_csv("initial_hospital_state.csv", sep=',')
-        main()
+        record = self.store.get(pateintID)
+        self.store.discharge(pateintID)
+        return record
 
-    # Function for Updating Status for a patient
+    # Function for Updating Status for a patient, returns the updated record
     def update_status(self, patientID, newStatus):
-        df = self.read_hospital_csv()
-        df.loc[df.Patient_ID == patientID, 'Status'] = newStatus
-        print(df)
-        df.to_csv("initial_hospital_state.csv", sep=',')
-        main()
+        self.store.update_status(patientID, newStatus)
+        return self.store.get(patientID)
 
-filePath = getFilePath() # I put this outside since I looped by using calling main()
-def main():
 
-    # Main function for the program
-    x = PatientManagementSystem()
-    dfPatients = x.read_hospital_csv(filePath) # change to correct file path if required
+# Run operations non-interactively, one per line:
+#   add <hospital> <status> <covid>
+#   transfer <patientID> <hospital>
+#   status <patientID> <newStatus>
+#   discharge <patientID>
+#   list [hospital=H] [status=S] [covid=C] [sort=COLUMN] [desc] [offset=N] [limit=N]
+#   occupancy
+# Blank lines and lines starting with '#' are skipped. Returns (succeeded, failed).
+def run_commands(x, lines):
+    succeeded = 0
+    failed = 0
+    for lineNo, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            args = shlex.split(line)
+            op = args[0].lower()
+            if op == 'add' and len(args) == 4:
+                record = x.add_patient(args[1], args[2], args[3])
+                if record is None:
+                    raise ValueError("ICU at " + args[1] + " is full")
+                print("added " + record['Patient_ID'])
+            elif op == 'transfer' and len(args) == 3:
+                if x.transfer_patient(args[1], args[2]) is None:
+                    raise ValueError("ICU at " + args[2] + " is full")
+            elif op == 'status' and len(args) == 3:
+                x.update_status(args[1], args[2])
+            elif op == 'discharge' and len(args) == 2:
+                x.discharge_patient(args[1])
+            elif op == 'list':
+                print_records(x.store.columns, x.list_patients(**list_options(args[1:])))
+            elif op == 'occupancy' and len(args) == 1:
+                print(x.group_by_hospital())
+            else:
+                raise ValueError("unrecognised command")
+            succeeded += 1
+        except KeyError as e:
+            print("line " + str(lineNo) + ": no patient with ID " + str(e.args[0]))
+            failed += 1
+        except ConflictError as e:
+            print("line " + str(lineNo) + ": " + str(e) + ", reloading")
+            x.store.refresh()
+            failed += 1
+        except ValueError as e:
+            print("line " + str(lineNo) + ": " + str(e) + ": " + line)
+            failed += 1
+    print(str(succeeded) + " operations applied, " + str(failed) + " failed")
+    return succeeded, failed
+
+
+# Parse the key=value options of the 'list' command into list_patients arguments
+def list_options(args):
+    names = {'hospital': 'hospital', 'status': 'status', 'covid': 'covid', 'sort': 'sortBy',
+             'offset': 'offset', 'limit': 'limit'}
+    options = {}
+    for arg in args:
+        if arg == 'desc':
+            options['descending'] = True
+            continue
+        key, sep, value = arg.partition('=')
+        if not sep or key not in names:
+            raise ValueError("unrecognised list option " + arg)
+        options[names[key]] = int(value) if key in ('offset', 'limit') else value
+    return options
+
+# Print a header and then one tab-separated line per record as it is produced
+def print_records(columns, records):
+    print('\t'.join(columns))
+    for record in records:
+        print('\t'.join(str(record[col]) for col in columns))
+
+# Print a single patient record
+def print_record(record):
+    print(', '.join(col + ': ' + str(value) for col, value in record.items()))
+
+
+# Interactive menu loop
+def interactive(x):
     print("\nWelcome to the VinsCorp Patient Management System.")
-    mainMenuMessage()
-    userChoice = getUserChoice()
+    while True:
+        mainMenuMessage()
+        userChoice = getUserChoice()
+        x.store.refresh() # pick up changes made by other operators
+        try:
+            menu_choice(x, userChoice)
+        except ConflictError as e:
+            print(str(e) + ", please try again.")
+            x.store.refresh()
+        except ValueError as e:
+            print(str(e) + ", please try again.")
+        if userChoice == 'exit':
+            print("\nTerminating program, goodbye.")
+            break
 
 
+# True if the answer is a covid flag the store accepts
+def is_covid_flag(value):
+    try:
+        parse_covid(value)
+    except ValueError:
+        return False
+    return True
+
+
+# Patients shown per page by the 'Patient list' menu option
+PAGE_SIZE = 20
+
+# Carry out one menu choice
+def menu_choice(x, userChoice):
+
     # add patient
     if userChoice == '1':
         hospital = input('Enter the hospital where the patient has to be added: ')
         sevStatus = input('Enter severity status of the patient: ')
         covidPositive = input('Enter if the patient has been detected covid or not: ')
-        x.add_patient(hospital, sevStatus, covidPositive)
+        while not is_covid_flag(covidPositive):
+            print("Please answer yes or no.")
+            covidPositive = input('Enter if the patient has been detected covid or not: ')
+        print(x.group_by_hospital())
+        record = x.add_patient(hospital, sevStatus, covidPositive)
+        while record is None:
+            print("Cannot transfer to " + hospital + " Hospital as the ICU at " + hospital + " is full.")
+            print("Please transfer to another hospital")
+            hospital = input('Enter the new hospital')
+            record = x.add_patient(hospital, sevStatus, covidPositive)
+        print_record(record)
 
     # transfer patient
     elif userChoice == '2':
         patientID = input('Enter patient ID: ')
         newHospitalName = input('Enter the hospital where the patient should be transferred: ')
-        x.transfer_patient(patientID, newHospitalName)
+        try:
+            print(x.store.occupancy(newHospitalName))
+            record = x.transfer_patient(patientID, newHospitalName)
+            while record is None:
+                print("Cannot transfer to " + newHospitalName + " Hospital as the ICU at " + newHospitalName + " are full.")
+                print("Please transfer to another hospital")
+                newHospitalName = input('Enter the new hospital')
+                record = x.transfer_patient(patientID, newHospitalName)
+            print_record(record)
+        except KeyError:
+            print("No patient with ID " + patientID)
 
     # discharge patient
     elif userChoice == '3':
         patientID = input('Enter patient ID: ')
-        x.discharge_patient(patientID)
+        try:
+            print_record(x.discharge_patient(patientID))
+        except KeyError:
+            print("No patient with ID " + patientID)
 
     # update patient
     elif userChoice == '4':
         patientID = input('Enter patient ID: ')
         newStatus = input("Enter patient's updated status: ")
-        x.update_status(patientID, newStatus)
+        try:
+            print_record(x.update_status(patientID, newStatus))
+        except KeyError:
+            print("No patient with ID " + patientID)
 
-    # print patient list
+    # print patient list a page at a time
     elif userChoice == '5':
-        print(dfPatients)
-        main()
+        hospital = input('Enter a hospital to list (leave blank for all): ') or None
+        offset = 0
+        while True:
+            page = list(x.list_patients(hospital=hospital, offset=offset, limit=PAGE_SIZE))
+            print_records(x.store.columns, page)
+            offset += len(page)
+            if len(page) < PAGE_SIZE or input("Press Enter for more or 'q' to stop: ").lower() == 'q':
+                break
 
-    # exit program
-    elif userChoice == 'exit':
-        print("\nTerminating program, goodbye.")
-        quit() # stop script execution
+
+def main(argv=None):
+
+    # Main function for the program
+    parser = argparse.ArgumentParser(description='VinsCorp Patient Management System')
+    parser.add_argument('census', nargs='?', help='hospital census CSV (prompted for if omitted)')
+    parser.add_argument('--commands', metavar='FILE',
+                        help="run the operations in FILE ('-' for stdin) instead of the menu")
+    parser.add_argument('--import-csv', metavar='CSV',
+                        help='load the patients in CSV into an SQLite (.db) census first')
+    parser.add_argument('--export-csv', metavar='CSV', help='write the census to CSV before exiting')
+    args = parser.parse_args(argv)
+
+    filePath = args.census or getFilePath()
+    x = PatientManagementSystem(filePath) # census is loaded once and kept in memory
+    try:
+        if args.import_csv:
+            if not hasattr(x.store, 'import_csv'):
+                parser.error('--import-csv needs an SQLite census (.db)')
+            x.store.import_csv(args.import_csv)
+        if args.commands == '-':
+            run_commands(x, sys.stdin)
+        elif args.commands:
+            with open(args.commands) as commandFile:
+                run_commands(x, commandFile)
+        else:
+            interactive(x)
+        if args.export_csv:
+            x.store.export_csv(args.export_csv)
+    finally:
+        x.store.close()
 
 
 # Run main function from the df_pms.py script
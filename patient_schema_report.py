@@ -0,0 +1,75 @@
+"""
+Memory and latency of the typed census representation
+
+Builds a synthetic census of each size and compares the plain object-dtype
+DataFrame the system used to keep with the typed frame from apply_schema
+(categorical Hospital/Status, boolean Covid_Positive) and with the
+PatientStore column arrays: bytes per patient, per-hospital counts and a
+filtered listing.
+
+Usage: python patient_schema_report.py [--sizes 10000 100000 1000000] [--repeat 20]
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import pandas as pd
+from patient_store import PatientStore, apply_schema
+from patient_store_benchmark import make_census
+
+def best_of(fn, repeat):
+    """Runs fn `repeat` times and returns the fastest run in milliseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def store_bytes(store):
+    """Bytes held by the PatientStore column arrays for its live patients."""
+    size = len(store)
+    arrays = [store.idColumn, store.covid] + list(store.codes.values())
+    return sum(array[:size].nbytes for array in arrays)
+
+def run(sizes, repeat):
+    """Measures each representation at each census size and returns a results table."""
+    rows = []
+    for size in sizes:
+        census = make_census(size).astype(object)
+        typed = apply_schema(census.copy())
+        with tempfile.TemporaryDirectory() as dirPath:
+            filePath = os.path.join(dirPath, 'census.csv')
+            census.to_csv(filePath, sep=',')
+            store = PatientStore(filePath)
+            candidates = [
+                ('object frame', census.memory_usage(deep=True).sum(),
+                 lambda: census.groupby('Hospital').size(),
+                 lambda: census[(census['Hospital'] == 'Toronto') & (census['Covid_Positive'] == 'yes')]),
+                ('typed frame', typed.memory_usage(deep=True).sum(),
+                 lambda: typed.groupby('Hospital', observed=True).size(),
+                 lambda: typed[(typed['Hospital'] == 'Toronto') & typed['Covid_Positive']]),
+                ('store arrays', store_bytes(store),
+                 store.counts,
+                 lambda: list(store.iter_patients(hospital='Toronto', covid='yes', limit=100))),
+            ]
+            for name, nbytes, count, select in candidates:
+                row = {'representation': name, 'patients': size,
+                       'bytes_per_patient': round(nbytes / size, 1),
+                       'counts_ms': round(best_of(count, repeat), 3),
+                       'filter_ms': round(best_of(select, repeat), 3)}
+                rows.append(row)
+                print(row)
+            store.close()
+    return pd.DataFrame(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare object-dtype and typed census representations')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=20, help='runs per measurement, best is reported')
+    args = parser.parse_args()
+    print(run(args.sizes, args.repeat).to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Local HTTP/JSON service for the Patient Management System
+
+Serves one census over HTTP on localhost using asyncio and only the standard
+library. Every store operation runs on a single writer thread, so mutations
+are applied one at a time in arrival order. Per-hospital occupancy is
+answered from a snapshot refreshed after each write, and pages of the patient
+list are read from the store a page at a time and cached until the next
+write.
+
+Endpoints:
+    GET    /patients                   census as a list of records, a page at a time:
+                                       ?hospital=&status=&covid= filter,
+                                       ?sort=<column>&desc=1 sort, ?offset=&limit= page
+    GET    /occupancy                  patients and capacity per hospital
+    POST   /patients                   {"hospital", "status", "covid"} -> new patient record
+    POST   /patients/<id>/transfer     {"hospital"}
+    POST   /patients/<id>/status       {"status"}
+    DELETE /patients/<id>              discharge
+
+Usage: python patient_service.py census.csv [--host 127.0.0.1] [--port 8080]
+"""
+
+import json
+import asyncio
+import argparse
+import collections
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from patient_management_system import PatientManagementSystem
+from patient_store import ConflictError
+
+# Records returned by GET /patients when no limit is given
+DEFAULT_LIMIT = 100
+
+# GET /patients pages kept in the cache, least recently used dropped first
+PAGE_CACHE_SIZE = 64
+
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 500: 'Internal Server Error'}
+
+
+# Raised by a handler to send an error response
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class PatientService:
+    def __init__(self, filePath):
+        self.filePath = filePath
+        self.writer = ThreadPoolExecutor(max_workers=1) # the only thread that touches the store
+        self.pms = None
+        self.occupancy = None # snapshot served by GET /occupancy
+        self.generation = 0 # number of writes applied, bumped on the writer thread
+        self.patients = collections.OrderedDict() # query -> (generation, encoded GET /patients page)
+
+    # Run fn(*args) on the writer thread
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.writer, fn, *args)
+
+    async def open(self):
+        self.pms = await self.run(PatientManagementSystem, self.filePath)
+        await self.publish()
+
+    async def close(self):
+        await self.run(lambda pms: pms.store.close(), self.pms)
+        self.writer.shutdown()
+
+    # Take the occupancy snapshot
+    async def publish(self):
+        self.occupancy = await self.run(occupancy_records, self.pms)
+
+    # Apply a mutation on the writer thread, reloading and retrying once if
+    # another process changed the census first. The occupancy snapshot is
+    # taken on the same trip to the writer thread.
+    async def mutate(self, fn, *args):
+        def apply():
+            try:
+                try:
+                    return fn(self.pms, *args), None
+                except ConflictError:
+                    self.pms.store.refresh()
+                    return fn(self.pms, *args), None
+            except (KeyError, ConflictError) as e:
+                return None, e
+            finally:
+                self.occupancy = occupancy_records(self.pms)
+                self.generation += 1
+
+        result, error = await self.run(apply)
+        if isinstance(error, KeyError):
+            raise HttpError(404, 'no patient with ID ' + str(error.args[0]))
+        if error is not None:
+            raise HttpError(409, str(error))
+        return result
+
+    # A page of the census as encoded JSON, built on the writer thread and
+    # reused until the next write. Each page is stamped with the generation it
+    # was built at and only cached if no write has landed since.
+    async def get_patients(self, query):
+        cached = self.patients.get(query)
+        if cached is not None and cached[0] == self.generation:
+            self.patients.move_to_end(query)
+            return cached[1]
+        options = list_options(query)
+        generation, page = await self.run(lambda: (self.generation, patient_page(self.pms, options)))
+        if generation == self.generation:
+            self.patients[query] = (generation, page)
+            self.patients.move_to_end(query)
+            if len(self.patients) > PAGE_CACHE_SIZE:
+                self.patients.popitem(last=False)
+        return page
+
+    # Route a request to its handler, returns (status, body)
+    async def handle(self, method, path, body):
+        path, _, query = path.partition('?')
+        parts = [part for part in path.split('/') if part]
+        if parts == ['occupancy'] and method == 'GET':
+            return 200, {'occupancy': self.occupancy}
+        if parts == ['patients'] and method == 'GET':
+            return 200, await self.get_patients(query)
+        if parts == ['patients'] and method == 'POST':
+            hospital, status, covid = fields(body, 'hospital', 'status', 'covid')
+            record = await self.mutate(PatientManagementSystem.add_patient, hospital, status, covid)
+            if record is None:
+                raise HttpError(409, 'ICU at ' + hospital + ' is full')
+            return 201, record
+        if len(parts) == 3 and parts[0] == 'patients' and parts[2] == 'transfer' and method == 'POST':
+            hospital, = fields(body, 'hospital')
+            record = await self.mutate(PatientManagementSystem.transfer_patient, parts[1], hospital)
+            if record is None:
+                raise HttpError(409, 'ICU at ' + hospital + ' is full')
+            return 200, record
+        if len(parts) == 3 and parts[0] == 'patients' and parts[2] == 'status' and method == 'POST':
+            status, = fields(body, 'status')
+            return 200, await self.mutate(PatientManagementSystem.update_status, parts[1], status)
+        if len(parts) == 2 and parts[0] == 'patients' and method == 'DELETE':
+            return 200, await self.mutate(PatientManagementSystem.discharge_patient, parts[1])
+        if parts[:1] in (['patients'], ['occupancy']):
+            raise HttpError(405, method + ' not allowed on ' + path)
+        raise HttpError(404, 'no route for ' + path)
+
+    # Serve HTTP/1.1 requests on one connection until the client closes it
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, raw = request
+                try:
+                    body = json.loads(raw) if raw else {}
+                    status, payload = await self.handle(method, path, body)
+                except HttpError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except ValueError as e:
+                    status, payload = 400, {'error': str(e)}
+                except Exception as e:
+                    status, payload = 500, {'error': repr(e)}
+                writer.write(encode_response(status, payload))
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        await self.open()
+        server = await asyncio.start_server(self.serve_connection, host, port)
+        return server
+
+
+# Turn a GET /patients query string into list_patients arguments
+def list_options(query):
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    options = {'hospital': params.get('hospital'), 'status': params.get('status'),
+               'covid': params.get('covid'), 'sortBy': params.get('sort'),
+               'descending': params.get('desc', '0') not in ('0', 'false', ''),
+               'offset': int(params.get('offset', 0)), 'limit': int(params.get('limit', DEFAULT_LIMIT))}
+    return options
+
+# A page of patient records as an encoded {"patients": [...], "offset": n} response body
+def patient_page(pms, options):
+    records = list(pms.list_patients(**options))
+    return json.dumps({'patients': records, 'offset': options['offset']}, default=str).encode()
+
+# Patients and capacity per hospital as a list of JSON-ready records
+def occupancy_records(pms):
+    counts = pms.store.counts()
+    return [{'Hospital': hospital, 'Patients': int(counts.get(hospital, 0)),
+             'Capacity': int(pms.capacity.get(hospital, 0))}
+            for hospital in sorted(set(pms.capacity) | set(counts))]
+
+# Pull required string fields out of a request body
+def fields(body, *names):
+    missing = [name for name in names if name not in body]
+    if missing:
+        raise ValueError('missing field(s): ' + ', '.join(missing))
+    return [str(body[name]) for name in names]
+
+# Read one request, returns (method, path, headers, body) or None at end of stream
+async def read_request(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+# Encode a response; payload is a JSON-ready object or an already encoded body
+def encode_response(status, payload):
+    body = payload if isinstance(payload, bytes) else json.dumps(payload, default=str).encode()
+    head = ('HTTP/1.1 ' + str(status) + ' ' + REASONS.get(status, '') + '\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: ' + str(len(body)) + '\r\n\r\n')
+    return head.encode('latin-1') + body
+
+
+async def run_service(filePath, host, port):
+    service = PatientService(filePath)
+    server = await service.serve(host, port)
+    print('Serving ' + filePath + ' on http://' + host + ':' + str(port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP/JSON service for the Patient Management System')
+    parser.add_argument('census', help='hospital census (.csv or .db)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_service(args.census, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
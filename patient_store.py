@@ -0,0 +1,697 @@
+import os
+import json
+import atexit
+import sqlite3
+import itertools
+import contextlib
+import numpy as np
+import pandas as pd
+from patient_history import EventLog, entry_event
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+# Characters reserved for the counter in <csv>.version
+VERSION_WIDTH = 20
+
+# Census columns used when a new database is created without a CSV to import
+DEFAULT_COLUMNS = ['Patient_ID', 'Hospital', 'Status', 'Covid_Positive']
+
+# Minimum width of the fixed-width Patient_ID column, widened if a longer ID arrives
+ID_WIDTH = 12
+
+# Columns held as integer codes into a list of categories
+CATEGORICAL = ['Hospital', 'Status']
+
+# Accepted spellings of the covid flag
+COVID_TRUE = {'yes', 'y', 'true', 't', '1', 'positive', 'pos'}
+COVID_FALSE = {'no', 'n', 'false', 'f', '0', 'negative', 'neg', '', 'nan', 'none'}
+
+# Covid flag as a bool, raises ValueError for an unrecognised value
+def parse_covid(value):
+    text = str(value).strip().lower()
+    if text in COVID_TRUE:
+        return True
+    if text in COVID_FALSE:
+        return False
+    raise ValueError("Unrecognised covid flag " + repr(value))
+
+# Census frame with the compact schema: categorical Hospital and Status and a
+# boolean covid flag. The in-memory PatientStore keeps this layout throughout;
+# the SQLite store applies it when it builds a frame.
+def apply_schema(df):
+    covidCol = df.columns[3]
+    return df.astype({col: 'category' for col in CATEGORICAL}).assign(
+        **{covidCol: df[covidCol].map(parse_covid).astype(bool)})
+
+# Read inital CSV file
+def read_hospital_csv(filePath):
+    return pd.read_csv(filePath, index_col=0) # file path may differ; first column is the index
+
+# Raised when another process changed the census after this one loaded it
+class ConflictError(Exception):
+    pass
+
+
+class PatientStore:
+    # In-memory census: the CSV snapshot is parsed once and every mutation is
+    # applied in place and appended to a write-ahead log next to the snapshot.
+    # The log is folded back into the CSV once it holds more entries than
+    # `compactFraction` of the census (and at least `compactEvery`), and at
+    # exit, so the cost of rewriting the CSV stays O(1) per operation however
+    # large the census grows.
+    #
+    # Several processes may share one census. Writers take an exclusive lock on
+    # <csv>.lock and bump the counter in <csv>.version; a writer whose in-memory
+    # version is behind gets a ConflictError and must refresh() before retrying.
+    # Readers only need a shared lock while loading, and the snapshot is replaced
+    # by rename so they never see a half-written file.
+    #
+    # With `history` every committed operation is also recorded as a timestamped
+    # event in <csv>.history (see patient_history.EventLog).
+    def __init__(self, filePath, compactEvery=1000, history=True, compactFraction=1.0):
+        self.filePath = filePath
+        self.logPath = filePath + '.log'
+        self.lockPath = filePath + '.lock'
+        self.versionPath = filePath + '.version'
+        self.compactEvery = compactEvery
+        self.compactFraction = compactFraction
+        self.lockFile = open(self.lockPath, 'a+')
+        self.versionFd = os.open(self.versionPath, os.O_RDWR | os.O_CREAT)
+        self.txEntries = None
+        self.load()
+        self.logFile = open(self.logPath, 'a')
+        self.history = EventLog(filePath + '.history') if history else None
+        if self.history is not None:
+            with self.locked():
+                start_history(self)
+        atexit.register(self.close)
+
+    # Hold the advisory lock on <csv>.lock for the duration of a with block
+    @contextlib.contextmanager
+    def locked(self, shared=False):
+        if fcntl is not None:
+            fcntl.flock(self.lockFile, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else: # Windows has no shared locks, fall back to exclusive
+            self.lockFile.seek(0)
+            msvcrt.locking(self.lockFile.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+            else:
+                self.lockFile.seek(0)
+                msvcrt.locking(self.lockFile.fileno(), msvcrt.LK_UNLCK, 1)
+
+    # Version counter on disk, 0 for a census that has never been written to.
+    # It is a fixed-width field rewritten in place with a single small write.
+    def read_version(self):
+        os.lseek(self.versionFd, 0, os.SEEK_SET)
+        return int(os.read(self.versionFd, VERSION_WIDTH) or 0)
+
+    def write_version(self, version):
+        os.lseek(self.versionFd, 0, os.SEEK_SET)
+        os.write(self.versionFd, str(version).rjust(VERSION_WIDTH).encode())
+
+    # Load the snapshot and replay the log
+    def load(self):
+        with self.locked(shared=True):
+            self.version = self.read_version()
+            self.load_columns(read_hospital_csv(self.filePath))
+            self.pending = self.replay_log()
+
+    # Reload if another process has committed since this one last loaded
+    def refresh(self):
+        if self.read_version() != self.version:
+            self.load()
+
+    # Convert the census to typed column arrays with spare room to grow:
+    # a fixed-width string array of IDs, integer codes for the categorical
+    # columns and a bool array for the covid flag. Patient_ID -> row position
+    # is kept in rowIndex and patients per hospital code in hospitalCounts.
+    def load_columns(self, df):
+        self.columns = list(df.columns)
+        self.size = len(df)
+        capacity = self.size + self.size // 4 + 16
+        ids = df['Patient_ID'].astype(str).to_numpy()
+        width = max([ID_WIDTH] + [len(id) for id in ids])
+        self.idColumn = np.empty(capacity, dtype='U' + str(width))
+        self.idColumn[:self.size] = ids
+        self.categories = {}
+        self.categoryCodes = {}
+        self.codes = {}
+        for col in CATEGORICAL:
+            values = pd.Categorical(df[col])
+            self.categories[col] = list(values.categories)
+            self.categoryCodes[col] = {value: code for code, value in enumerate(self.categories[col])}
+            self.codes[col] = np.full(capacity, -1, dtype=np.int32)
+            self.codes[col][:self.size] = values.codes
+        self.covid = np.zeros(capacity, dtype=bool)
+        self.covid[:self.size] = [parse_covid(value) for value in df[self.columns[3]]]
+        hospitalCodes = self.codes['Hospital'][:self.size]
+        self.hospitalCounts = np.bincount(hospitalCodes[hospitalCodes >= 0],
+                                          minlength=len(self.categories['Hospital']))
+        self.rowIndex = dict(zip(ids.tolist(), range(self.size)))
+        if len(self.rowIndex) != self.size:
+            duplicate = df['Patient_ID'][df['Patient_ID'].duplicated()].iloc[0]
+            raise ValueError("Duplicate Patient_ID " + str(duplicate) + " in " + self.filePath)
+
+    # Code for a categorical value, adding it as a new category if unseen
+    def encode(self, col, value):
+        code = self.categoryCodes[col].get(value)
+        if code is None:
+            code = len(self.categories[col])
+            self.categories[col].append(value)
+            self.categoryCodes[col][value] = code
+            if col == 'Hospital':
+                self.hospitalCounts = np.append(self.hospitalCounts, 0)
+        return code
+
+    def decode(self, col, code):
+        return self.categories[col][code] if code >= 0 else None
+
+    # Make room for `size` rows, doubling the arrays when they are full
+    def reserve(self, size):
+        capacity = len(self.covid)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2)
+        self.idColumn = grow(self.idColumn, capacity, '')
+        self.codes = {col: grow(codes, capacity, -1) for col, codes in self.codes.items()}
+        self.covid = grow(self.covid, capacity, False)
+
+    def __contains__(self, patientID):
+        return patientID in self.rowIndex
+
+    def __len__(self):
+        return self.size
+
+    def ids(self):
+        return iter(self.rowIndex)
+
+    # Number of patients at a hospital, kept current by every applied operation
+    def occupancy(self, hospitalName):
+        code = self.categoryCodes['Hospital'].get(hospitalName)
+        return 0 if code is None else int(self.hospitalCounts[code])
+
+    # Hospital -> number of patients
+    def counts(self):
+        return {hospital: int(count) for hospital, count in zip(self.categories['Hospital'], self.hospitalCounts)
+                if count}
+
+    # Re-apply operations logged since the last snapshot
+    def replay_log(self):
+        count = 0
+        if not os.path.isfile(self.logPath):
+            return count
+        with open(self.logPath) as logFile:
+            for line in logFile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break # torn write at the end of the log
+                self.apply(entry)
+                count += 1
+        return count
+
+    # Position of a patient in the column arrays, raises KeyError if unknown
+    def find(self, patientID):
+        return self.rowIndex[patientID]
+
+    # Apply a single logged operation to the in-memory columns and indexes.
+    # Operations are idempotent (add overwrites, unknown IDs are ignored) so a
+    # log replayed over a snapshot that already contains it gives the same census.
+    def apply(self, entry):
+        op = entry[0]
+        if op != 'add' and entry[1] not in self.rowIndex:
+            return
+        if op == 'add':
+            patientID, hospital, status, covid = entry[1:5]
+            if patientID in self.rowIndex:
+                self.apply(['discharge', patientID])
+            if len(patientID) > self.idColumn.itemsize // 4:
+                self.idColumn = self.idColumn.astype('U' + str(len(patientID)))
+            i = self.size
+            self.reserve(i + 1)
+            self.idColumn[i] = patientID
+            self.codes['Hospital'][i] = self.encode('Hospital', hospital)
+            self.codes['Status'][i] = self.encode('Status', status)
+            self.covid[i] = parse_covid(covid)
+            self.hospitalCounts[self.codes['Hospital'][i]] += 1
+            self.rowIndex[patientID] = i
+            self.size += 1
+        elif op == 'transfer':
+            i = self.find(entry[1])
+            if self.codes['Hospital'][i] >= 0:
+                self.hospitalCounts[self.codes['Hospital'][i]] -= 1
+            self.codes['Hospital'][i] = self.encode('Hospital', entry[2])
+            self.hospitalCounts[self.codes['Hospital'][i]] += 1
+        elif op == 'status':
+            self.codes['Status'][self.find(entry[1])] = self.encode('Status', entry[2])
+        elif op == 'discharge':
+            # move the last row into the freed slot so no other row shifts
+            i = self.rowIndex.pop(entry[1])
+            if self.codes['Hospital'][i] >= 0:
+                self.hospitalCounts[self.codes['Hospital'][i]] -= 1
+            last = self.size - 1
+            if i != last:
+                self.idColumn[i] = self.idColumn[last]
+                for codes in self.codes.values():
+                    codes[i] = codes[last]
+                self.covid[i] = self.covid[last]
+                self.rowIndex[str(self.idColumn[i])] = i
+            self.size -= 1
+
+    # Group operations so they are checked against one consistent census and
+    # logged in one write. Writes made inside the block are buffered and become
+    # visible when it ends; nothing is applied if it raises. Raises
+    # ConflictError if the census on disk is newer than this copy.
+    @contextlib.contextmanager
+    def transaction(self):
+        if self.txEntries is not None: # already inside one
+            yield
+            return
+        with self.locked():
+            diskVersion = self.read_version()
+            if diskVersion != self.version:
+                raise ConflictError("census was changed by another process (version "
+                                    + str(diskVersion) + ", expected " + str(self.version) + ")")
+            self.txEntries = []
+            try:
+                yield
+                entries = self.txEntries
+            finally:
+                self.txEntries = None
+            if entries:
+                self.write(entries)
+
+    # Caller holds the exclusive lock
+    def write(self, entries):
+        events = []
+        for entry in entries:
+            if self.history is not None:
+                current = self.get(entry[1]) if entry[1] in self.rowIndex else None
+                events.append(entry_event(entry, current))
+            self.apply(entry)
+        if events:
+            self.history.append([event for event in events if event is not None])
+        self.logFile.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        self.logFile.flush()
+        self.version += len(entries)
+        self.write_version(self.version)
+        self.pending += len(entries)
+        if self.pending >= max(self.compactEvery, self.compactFraction * self.size):
+            self.write_snapshot()
+
+    # Apply an operation and append it to the log
+    def commit(self, entry):
+        self.commit_many([entry])
+
+    # Apply several operations and append them to the log with one write
+    def commit_many(self, entries):
+        with self.transaction():
+            self.txEntries.extend(entries)
+
+    def add(self, patientID, hospitalName, sevStatus, covidPositive):
+        if patientID in self.rowIndex:
+            raise ValueError("Patient_ID " + patientID + " is already in use")
+        parse_covid(covidPositive) # reject an unrecognised flag before logging it
+        self.commit(['add', patientID, hospitalName, sevStatus, covidPositive])
+
+    def transfer(self, patientID, newHospitalName):
+        self.find(patientID) # raise before logging an unknown patient
+        self.commit(['transfer', patientID, newHospitalName])
+
+    def update_status(self, patientID, newStatus):
+        self.find(patientID)
+        self.commit(['status', patientID, newStatus])
+
+    def discharge(self, patientID):
+        self.find(patientID)
+        self.commit(['discharge', patientID])
+
+    # One patient as a {column: value} record, raises KeyError if unknown
+    def get(self, patientID):
+        return self.record(self.find(patientID))
+
+    def record(self, i):
+        return dict(zip(self.columns, [str(self.idColumn[i]),
+                                       self.decode('Hospital', self.codes['Hospital'][i]),
+                                       self.decode('Status', self.codes['Status'][i]),
+                                       bool(self.covid[i])]))
+
+    # Sort key array for a column over the given rows; categorical columns
+    # sort by category value with missing values first
+    def sort_key(self, col, rows):
+        if col == self.columns[0]:
+            return self.idColumn[rows]
+        if col == self.columns[3]:
+            return self.covid[rows]
+        if col not in self.codes:
+            raise ValueError("Unknown column " + str(col))
+        categories = self.categories[col]
+        order = sorted(range(len(categories)), key=lambda code: str(categories[code]))
+        rank = np.empty(len(categories) + 1, dtype=np.int64)
+        rank[order] = np.arange(len(categories))
+        rank[-1] = -1 # code -1 (missing) picks the last slot
+        return rank[self.codes[col][rows]]
+
+    # Yield patient records lazily, optionally filtered on hospital, status and
+    # covid flag, sorted on a column, and paged with offset/limit. Filters are
+    # vectorized comparisons on the integer codes; only the matching row
+    # numbers are collected up front. The census must not be changed while the
+    # generator is being consumed.
+    def iter_patients(self, hospital=None, status=None, covid=None, sortBy=None, descending=False,
+                      offset=0, limit=None):
+        n = self.size
+        mask = None
+        for col, value in (('Hospital', hospital), ('Status', status)):
+            if value is not None:
+                match = self.codes[col][:n] == self.categoryCodes[col].get(value, -2)
+                mask = match if mask is None else mask & match
+        if covid is not None:
+            match = self.covid[:n] == parse_covid(covid)
+            mask = match if mask is None else mask & match
+        if mask is not None:
+            rows = np.flatnonzero(mask)
+        elif sortBy is not None:
+            rows = np.arange(n)
+        else:
+            rows = range(n)
+        if sortBy is not None:
+            rows = rows[np.argsort(self.sort_key(sortBy, rows), kind='stable')]
+            if descending:
+                rows = rows[::-1]
+        end = None if limit is None else offset + limit
+        for i in itertools.islice(rows, offset, end):
+            yield self.record(i)
+
+    # Current census as a DataFrame with the compact schema
+    def to_frame(self):
+        n = self.size
+        return pd.DataFrame({
+            self.columns[0]: self.idColumn[:n].copy(),
+            self.columns[1]: pd.Categorical.from_codes(self.codes['Hospital'][:n].copy(),
+                                                       categories=self.categories['Hospital']),
+            self.columns[2]: pd.Categorical.from_codes(self.codes['Status'][:n].copy(),
+                                                       categories=self.categories['Status']),
+            self.columns[3]: self.covid[:n].copy()})
+
+    def export_csv(self, csvPath):
+        self.to_frame().to_csv(csvPath, sep=',')
+
+    # Write the census back to the CSV snapshot and truncate the log, skipped
+    # if another process has committed since (its log entries must survive)
+    def compact(self):
+        with self.locked():
+            if self.read_version() == self.version:
+                self.write_snapshot()
+
+    # Caller holds the exclusive lock
+    def write_snapshot(self):
+        df = self.to_frame()
+        replace_file(self.filePath, lambda path: df.to_csv(path, sep=','))
+        self.logFile.truncate(0)
+        self.pending = 0
+
+    def close(self):
+        if self.logFile.closed:
+            return
+        atexit.unregister(self.close)
+        if self.pending:
+            self.compact()
+        self.logFile.close()
+        self.lockFile.close()
+        os.close(self.versionFd)
+        if self.history is not None:
+            self.history.close()
+
+
+# Copy an array into a larger one, filling the new slots with `fill`
+def grow(array, capacity, fill):
+    grown = np.full(capacity, fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+# Write a file through `write(tmpPath)` and rename it over `path`, so readers
+# see either the old or the new contents and a crash never leaves it half written
+def replace_file(path, write):
+    tmpPath = path + '.tmp' + str(os.getpid())
+    try:
+        write(tmpPath)
+        os.replace(tmpPath, path)
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
+
+# Quote a column name for use in SQL
+def quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+# Per-hospital patient counts kept current by triggers on the patients table,
+# so capacity checks read one row instead of counting the hospital's patients
+OCCUPANCY_SQL = """
+CREATE TABLE occupancy (Hospital TEXT PRIMARY KEY, Patients INTEGER NOT NULL);
+CREATE TRIGGER occupancy_insert AFTER INSERT ON patients WHEN NEW.Hospital IS NOT NULL BEGIN
+    INSERT INTO occupancy VALUES (NEW.Hospital, 1)
+        ON CONFLICT (Hospital) DO UPDATE SET Patients = Patients + 1;
+END;
+CREATE TRIGGER occupancy_delete AFTER DELETE ON patients WHEN OLD.Hospital IS NOT NULL BEGIN
+    UPDATE occupancy SET Patients = Patients - 1 WHERE Hospital = OLD.Hospital;
+END;
+CREATE TRIGGER occupancy_transfer_out AFTER UPDATE OF Hospital ON patients WHEN OLD.Hospital IS NOT NULL BEGIN
+    UPDATE occupancy SET Patients = Patients - 1 WHERE Hospital = OLD.Hospital;
+END;
+CREATE TRIGGER occupancy_transfer_in AFTER UPDATE OF Hospital ON patients WHEN NEW.Hospital IS NOT NULL BEGIN
+    INSERT INTO occupancy VALUES (NEW.Hospital, 1)
+        ON CONFLICT (Hospital) DO UPDATE SET Patients = Patients + 1;
+END;
+"""
+
+
+class SqlitePatientStore:
+    # Census kept in an SQLite database, indexed on Patient_ID (primary key) and
+    # Hospital. Each transaction() is a BEGIN IMMEDIATE ... COMMIT, so a capacity
+    # check and the write that depends on it cannot interleave with another
+    # writer, and WAL journaling lets readers carry on during a write.
+    # With `history` committed operations are recorded in <db>.history, as for
+    # the CSV store.
+    def __init__(self, dbPath, columns=None, history=True):
+        self.filePath = dbPath
+        self.closed = False
+        self.conn = sqlite3.connect(dbPath, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        existing = [row[1] for row in self.conn.execute('PRAGMA table_info(patients)')]
+        self.columns = existing or list(columns or DEFAULT_COLUMNS)
+        if not existing:
+            self.conn.execute('CREATE TABLE patients (' + quote(self.columns[0]) + ' TEXT PRIMARY KEY, '
+                              + ', '.join(quote(col) + ' TEXT' for col in self.columns[1:3]) + ', '
+                              + quote(self.columns[3]) + ' INTEGER)') # covid flag stored as 0/1
+            self.conn.execute('CREATE INDEX patients_hospital ON patients (' + quote(self.columns[1]) + ')')
+            self.conn.executescript(OCCUPANCY_SQL)
+        placeholders = ', '.join('?' * len(self.columns))
+        self.insertSql = 'INSERT INTO patients VALUES (' + placeholders + ')'
+        self.events = [] # history events of the open transaction
+        self.history = EventLog(dbPath + '.history') if history else None
+        if self.history is not None:
+            with self.transaction():
+                start_history(self)
+        atexit.register(self.close)
+
+    # Commit the block as one SQLite transaction, rolled back if it raises.
+    # Its history events are appended just before COMMIT, while the database
+    # write lock is still held.
+    @contextlib.contextmanager
+    def transaction(self):
+        if self.conn.in_transaction: # already inside one
+            yield
+            return
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+            if self.events:
+                self.history.append(self.events)
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        finally:
+            self.events = []
+        self.conn.execute('COMMIT')
+
+    def __contains__(self, patientID):
+        return self.conn.execute('SELECT 1 FROM patients WHERE Patient_ID = ?', (patientID,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM patients').fetchone()[0]
+
+    def ids(self):
+        return (row[0] for row in self.conn.execute('SELECT Patient_ID FROM patients'))
+
+    # Number of patients at a hospital, from the trigger-maintained occupancy table
+    def occupancy(self, hospitalName):
+        row = self.conn.execute('SELECT Patients FROM occupancy WHERE Hospital = ?', (hospitalName,)).fetchone()
+        return row[0] if row else 0
+
+    # Hospital -> number of patients
+    def counts(self):
+        return dict(self.conn.execute('SELECT Hospital, Patients FROM occupancy '
+                                      'WHERE Hospital IS NOT NULL AND Patients > 0'))
+
+    # Raise KeyError for an unknown patient
+    def find(self, patientID):
+        if patientID not in self:
+            raise KeyError(patientID)
+
+    # Apply a single operation, in the same form PatientStore logs them
+    def apply(self, entry):
+        op = entry[0]
+        if op == 'add':
+            self.conn.execute(self.insertSql, entry[1:4] + [int(parse_covid(entry[4]))])
+        elif op == 'transfer':
+            self.conn.execute('UPDATE patients SET Hospital = ? WHERE Patient_ID = ?', (entry[2], entry[1]))
+        elif op == 'status':
+            self.conn.execute('UPDATE patients SET Status = ? WHERE Patient_ID = ?', (entry[2], entry[1]))
+        elif op == 'discharge':
+            self.conn.execute('DELETE FROM patients WHERE Patient_ID = ?', (entry[1],))
+
+    def commit(self, entry):
+        self.commit_many([entry])
+
+    def commit_many(self, entries):
+        with self.transaction():
+            for entry in entries:
+                if self.history is not None:
+                    try:
+                        current = self.get(entry[1])
+                    except KeyError:
+                        current = None
+                    event = entry_event(entry, current)
+                    if event is not None:
+                        self.events.append(event)
+                self.apply(entry)
+
+    def add(self, patientID, hospitalName, sevStatus, covidPositive):
+        parse_covid(covidPositive) # reject an unrecognised flag before writing it
+        try:
+            self.commit(['add', patientID, hospitalName, sevStatus, covidPositive])
+        except sqlite3.IntegrityError:
+            raise ValueError("Patient_ID " + patientID + " is already in use")
+
+    def transfer(self, patientID, newHospitalName):
+        with self.transaction():
+            self.find(patientID)
+            self.commit(['transfer', patientID, newHospitalName])
+
+    def update_status(self, patientID, newStatus):
+        with self.transaction():
+            self.find(patientID)
+            self.commit(['status', patientID, newStatus])
+
+    def discharge(self, patientID):
+        with self.transaction():
+            self.find(patientID)
+            self.commit(['discharge', patientID])
+
+    # Every transaction reads the live database, so there is nothing to reload
+    def refresh(self):
+        pass
+
+    # One patient as a {column: value} record, raises KeyError if unknown
+    def get(self, patientID):
+        row = self.conn.execute('SELECT * FROM patients WHERE Patient_ID = ?', (patientID,)).fetchone()
+        if row is None:
+            raise KeyError(patientID)
+        return self.record(row)
+
+    # Row tuple as a {column: value} record with the covid flag as a bool
+    def record(self, row):
+        record = dict(zip(self.columns, row))
+        record[self.columns[3]] = bool(record[self.columns[3]])
+        return record
+
+    # Yield patient records lazily from a cursor, with filtering, sorting and
+    # paging done by SQLite
+    def iter_patients(self, hospital=None, status=None, covid=None, sortBy=None, descending=False,
+                      offset=0, limit=None):
+        clauses = []
+        params = []
+        if covid is not None:
+            covid = int(parse_covid(covid))
+        for col, value in ((self.columns[1], hospital), (self.columns[2], status), (self.columns[3], covid)):
+            if value is not None:
+                clauses.append(quote(col) + ' = ?')
+                params.append(value)
+        sql = 'SELECT * FROM patients'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        if sortBy is not None:
+            if sortBy not in self.columns:
+                raise ValueError("Unknown column " + str(sortBy))
+            sql += ' ORDER BY ' + quote(sortBy) + (' DESC' if descending else '')
+        sql += ' LIMIT ? OFFSET ?'
+        params += [-1 if limit is None else limit, offset]
+        for row in self.conn.execute(sql, params):
+            yield self.record(row)
+
+    # Current census as a DataFrame with the compact schema
+    def to_frame(self):
+        return apply_schema(pd.read_sql_query('SELECT * FROM patients', self.conn))
+
+    # Load a census CSV, replacing patients with the same Patient_ID
+    def import_csv(self, csvPath):
+        df = read_hospital_csv(csvPath).iloc[:, :len(self.columns)]
+        df[df.columns[3]] = df[df.columns[3]].map(parse_covid).astype(int)
+        upsert = (self.insertSql + ' ON CONFLICT (' + quote(self.columns[0]) + ') DO UPDATE SET '
+                  + ', '.join(quote(col) + ' = excluded.' + quote(col) for col in self.columns[1:]))
+        with self.transaction():
+            if self.history is not None: # a replaced patient leaves, then rejoins the census
+                current = {row[0]: row[1:] for row in self.conn.execute('SELECT Patient_ID, Hospital, Status '
+                                                                         'FROM patients')}
+                for patientID, hospital, status in zip(*(df[col] for col in df.columns[:3])):
+                    if patientID in current:
+                        self.events.append(('discharge', patientID) + current[patientID][:1] + (None,)
+                                           + current[patientID][1:])
+                    self.events.append(('census', patientID, hospital, None, status))
+                    current[patientID] = (hospital, status)
+            self.conn.executemany(upsert, df.astype(object).itertuples(index=False, name=None))
+
+    def export_csv(self, csvPath):
+        self.to_frame().to_csv(csvPath, sep=',')
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.conn.close()
+        if self.history is not None:
+            self.history.close()
+
+
+# Open the store's event history, starting it with a 'census' event for every
+# patient already present if it does not exist yet. Caller holds the store's
+# write lock so only one process starts it.
+def start_history(store):
+    isNew = not store.history.exists()
+    store.history.open()
+    if isNew:
+        events = []
+        for record in store.iter_patients():
+            patientID, hospital, status = list(record.values())[:3]
+            events.append(('census', patientID, hospital, None, status))
+        store.history.append(events)
+
+
+# Open the census at `filePath`: an SQLite database for .db/.sqlite files,
+# otherwise a CSV snapshot with an in-memory PatientStore
+def open_store(filePath, **kwargs):
+    if os.path.splitext(filePath)[1].lower() in ('.db', '.sqlite', '.sqlite3'):
+        return SqlitePatientStore(filePath, **kwargs)
+    return PatientStore(filePath, **kwargs)
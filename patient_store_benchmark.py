@@ -0,0 +1,112 @@
+"""
+Per-operation latency of the patient store backends
+
+Builds a synthetic census of each size, opens it with the CSV (in-memory
+PatientStore) and SQLite backends, and times admit, transfer, status update,
+discharge and occupancy operations through PatientManagementSystem.
+
+Usage: python patient_store_benchmark.py [--sizes 1000 100000 1000000] [--ops 1000]
+"""
+
+import os
+import time
+import random
+import argparse
+import tempfile
+import pandas as pd
+from patient_management_system import PatientManagementSystem
+from patient_store import SqlitePatientStore
+
+HOSPITALS = ['Toronto', 'Hamilton', 'Kingston']
+
+def make_census(size):
+    """Creates a census DataFrame with `size` patients spread over HOSPITALS.
+
+    :param size: number of patients
+    :return: census dataframe
+    """
+    return pd.DataFrame({'Patient_ID': ['b' + str(i).zfill(7) for i in range(size)],
+                         'Hospital': random.choices(HOSPITALS, k=size),
+                         'Status': random.choices(['stable', 'critical'], k=size),
+                         'Covid_Positive': random.choices(['yes', 'no'], k=size)})
+
+def write_capacity(dirPath, size):
+    """Writes a capacity table large enough that no operation is rejected."""
+    pd.DataFrame({'Hospital': HOSPITALS, 'Capacity': [size * 2] * len(HOSPITALS)}).to_csv(
+        os.path.join(dirPath, 'hospital_capacity.csv'), index=False)
+
+def time_ops(x, census, ops):
+    """Times each operation type and returns microseconds per operation.
+
+    :param x: PatientManagementSystem to run against
+    :param census: census dataframe the store was created from
+    :param ops: number of operations of each type
+    :return: dict of operation name -> microseconds per operation
+    """
+    ids = random.sample(list(census['Patient_ID']), ops)
+    timings = {}
+
+    start = time.perf_counter()
+    for _ in range(ops):
+        x.add_patient(random.choice(HOSPITALS), 'critical', 'yes')
+    timings['add'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for patientID in ids:
+        x.transfer_patient(patientID, random.choice(HOSPITALS))
+    timings['transfer'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for patientID in ids:
+        x.update_status(patientID, 'stable')
+    timings['status'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(ops):
+        x.group_by_hospital()
+    timings['occupancy'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for patientID in ids:
+        x.discharge_patient(patientID)
+    timings['discharge'] = time.perf_counter() - start
+
+    return {op: seconds / ops * 1e6 for op, seconds in timings.items()}
+
+def run(sizes, ops):
+    """Benchmarks both backends at each census size and returns a results table."""
+    rows = []
+    for size in sizes:
+        census = make_census(size)
+        for backend in ['csv', 'sqlite']:
+            with tempfile.TemporaryDirectory() as dirPath:
+                write_capacity(dirPath, size)
+                csvPath = os.path.join(dirPath, 'census.csv')
+                census.to_csv(csvPath, sep=',')
+                if backend == 'csv':
+                    filePath = csvPath
+                else:
+                    filePath = os.path.join(dirPath, 'census.db')
+                    store = SqlitePatientStore(filePath)
+                    store.import_csv(csvPath)
+                    store.close()
+                start = time.perf_counter()
+                x = PatientManagementSystem(filePath)
+                loadSeconds = time.perf_counter() - start
+                timings = time_ops(x, census, ops)
+                x.store.close()
+            row = {'backend': backend, 'patients': size, 'load_s': round(loadSeconds, 3)}
+            row.update({op + '_us': round(us, 1) for op, us in timings.items()})
+            rows.append(row)
+            print(row)
+    return pd.DataFrame(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the patient store backends')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--ops', type=int, default=1000, help='operations of each type per run')
+    args = parser.parse_args()
+    print(run(args.sizes, args.ops).to_string(index=False))
+
+if __name__ == '__main__':
+    main()